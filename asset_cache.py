@@ -0,0 +1,441 @@
+# asset_cache.py
+"""
+Shared, size-bounded cache of decoded composition assets.
+
+Decoding templates and sprites and loading TrueType fonts is repeated for
+every page and every book. This cache keeps the decoded objects in memory,
+keyed by file path plus modification time so edited files are picked up,
+and evicts the least recently used entries once the estimated memory use
+exceeds the configured budget.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageDraw, ImageFont
+
+# Extension fallbacks remembered per cache (see AssetCache._resolve)
+RESOLVED_PATHS_MAX = 1024
+
+
+def content_key(params: dict) -> str:
+    """Hashes a JSON-serializable description of some content into a stable key."""
+    encoded = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def write_atomically(path: Path, write):
+    """
+    Calls `write(temp_path)` to write a file under a temporary name next to
+    `path`, then renames it into place, so readers and a crash never leave
+    a partial file behind.
+    """
+    path = Path(path)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if temp_path.exists():
+            temp_path.unlink()
+        raise
+
+
+def mark_used(path: Path):
+    """Marks a stored file as just used, so `prune_directory` deletes it last."""
+    os.utime(path)
+
+
+def read_stored_image(path: Path) -> Image.Image:
+    """
+    Decodes a stored RGBA image and marks it as used.
+
+    Raises:
+        FileNotFoundError: If the file is missing, e.g. pruned.
+    """
+    with Image.open(path) as stored:
+        image = stored.convert("RGBA")
+    mark_used(path)
+    return image
+
+
+def prune_directory(directory: Path, max_bytes: int, group=None) -> int:
+    """
+    Deletes the least recently used files in `directory` until the rest fit
+    in `max_bytes`. Recency is the later of access and modification time, so
+    readers can mark a file as used with `mark_used`. Files whose names map
+    to the same `group(name)` are used and deleted together.
+
+    Returns:
+        Number of files deleted.
+    """
+    groups = {}  # group -> [last used, total bytes, paths]
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue  # In-flight writes are renamed into place when done
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        name = group(entry.name) if group else entry.name
+        usage = groups.setdefault(name, [0.0, 0, []])
+        usage[0] = max(usage[0], stat.st_atime, stat.st_mtime)
+        usage[1] += stat.st_size
+        usage[2].append(entry.path)
+
+    total_bytes = sum(usage[1] for usage in groups.values())
+    deleted = 0
+    for _, size_bytes, paths in sorted(groups.values(), key=lambda usage: usage[0]):
+        if total_bytes <= max_bytes:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+                deleted += 1
+            except FileNotFoundError:
+                pass  # Already pruned by another run
+        total_bytes -= size_bytes
+    return deleted
+
+
+class AssetCache:
+    """
+    Thread-safe LRU cache for decoded RGBA images and font objects.
+
+    Args:
+        max_bytes: Memory budget for cached entries. Images are counted at
+            4 bytes per pixel, fonts at the size of their font file.
+    """
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size_bytes)
+        self._resolved = OrderedDict()  # requested path -> fallback found on disk, most recent last
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_image(self, path: Path, fallback_exts: tuple = ()) -> Image.Image:
+        """
+        Returns the decoded RGBA image for `path`. The cached object is shared,
+        so callers must copy it before modifying it.
+
+        Args:
+            path: Image path to open.
+            fallback_exts: Extensions to try in order if `path` does not exist.
+
+        Raises:
+            FileNotFoundError: If neither `path` nor any fallback exists.
+        """
+        resolved, mtime = self._resolve(Path(path), fallback_exts)
+        key = ("image", str(resolved), mtime)
+        image = self._get(key)
+        if image is None:
+            with Image.open(resolved) as source:
+                image = source.convert("RGBA")
+            self._put(key, image, image.width * image.height * 4)
+        return image
+
+    def get_font(self, path: Path, size: int) -> ImageFont.FreeTypeFont:
+        """
+        Returns the TrueType font at `path` loaded at `size`.
+
+        Raises:
+            OSError: If the font file is missing or cannot be loaded.
+        """
+        path = Path(path)
+        stat = path.stat()
+        key = ("font", str(path), stat.st_mtime_ns, size)
+        font = self._get(key)
+        if font is None:
+            font = ImageFont.truetype(str(path), size=size)
+            self._put(key, font, stat.st_size)
+        return font
+
+    def get_default_font(self) -> ImageFont.ImageFont:
+        """Returns Pillow's built-in font, loaded once and shared."""
+        key = ("font", "default")
+        font = self._get(key)
+        if font is None:
+            font = ImageFont.load_default()
+            self._put(key, font, 64 * 1024)
+        return font
+
+    def get_digest(self, path: Path, fallback_exts: tuple = ()) -> str:
+        """Returns the SHA-256 of the file `path` resolves to, hashed once per mtime."""
+        resolved, mtime = self._resolve(Path(path), fallback_exts)
+        key = ("digest", str(resolved), mtime)
+        digest = self._get(key)
+        if digest is None:
+            digest = hashlib.sha256(resolved.read_bytes()).hexdigest()
+            self._put(key, digest, len(digest))
+        return digest
+
+    def resolved_path(self, path: Path, fallback_exts: tuple = ()) -> Path:
+        """Returns the file on disk that `path` resolves to."""
+        return self._resolve(Path(path), fallback_exts)[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._resolved.clear()
+            self.current_bytes = 0
+
+    def _resolve(self, path: Path, fallback_exts: tuple) -> tuple:
+        """Finds the file for `path` (remembering extension fallbacks) and its mtime."""
+        with self._lock:
+            resolved = self._resolved.get(path)
+            if resolved is not None:
+                self._resolved.move_to_end(path)
+        if resolved is not None:
+            try:
+                return resolved, resolved.stat().st_mtime_ns
+            except FileNotFoundError:
+                with self._lock:
+                    self._resolved.pop(path, None)
+
+        candidates = [path] + [path.with_suffix(ext) for ext in fallback_exts]
+        for candidate in candidates:
+            try:
+                mtime = candidate.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if candidate != path:
+                print(f"   - INFO: '{path.name}' not found, using '{candidate.name}' instead.")
+                # Only fallbacks are worth remembering, and only the most recent ones
+                with self._lock:
+                    self._resolved[path] = candidate
+                    while len(self._resolved) > RESOLVED_PATHS_MAX:
+                        self._resolved.popitem(last=False)
+            return candidate, mtime
+        if fallback_exts:
+            raise FileNotFoundError(f"Cannot find {path.with_suffix('').name} with {', '.join(fallback_exts)} extension.")
+        raise FileNotFoundError(f"Cannot find {path}.")
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _put(self, key, value, size_bytes: int):
+        evicted = []
+        with self._lock:
+            if size_bytes > self.max_bytes:
+                evicted.append((key, value))
+            elif key not in self._entries:
+                self._entries[key] = (value, size_bytes)
+                self.current_bytes += size_bytes
+                while self.current_bytes > self.max_bytes:
+                    evicted_key, (evicted_value, evicted_size) = self._entries.popitem(last=False)
+                    self.current_bytes -= evicted_size
+                    self.evictions += 1
+                    evicted.append((evicted_key, evicted_value))
+        for evicted_key, evicted_value in evicted:
+            self._on_evict(evicted_key, evicted_value)
+
+    def _on_evict(self, key, value):
+        """Called outside the lock for entries dropped from memory."""
+
+
+class EffectCache(AssetCache):
+    """
+    Content-addressed cache of derived sprite layers (transformed sprites,
+    shadow silhouettes, glows).
+
+    Entries are keyed by a hash of the source image digest plus every effect
+    parameter, so the same pose reused on other pages, or copied into another
+    job, maps to the same entry. Layers evicted from memory are spilled to
+    `spill_dir` as lossless PNGs and reloaded from there on the next miss.
+    Spills are written on a background thread, and the least recently used
+    spilled layers are deleted once the directory exceeds its budget.
+
+    Args:
+        max_bytes: Memory budget, counted at 4 bytes per pixel.
+        spill_dir: Optional directory for evicted layers; no spill if None.
+        spill_max_bytes: Disk budget for `spill_dir`.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, spill_dir: Path = None,
+                 spill_max_bytes: int = 1024 * 1024 * 1024):
+        super().__init__(max_bytes=max_bytes)
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.spill_max_bytes = spill_max_bytes
+        self.disk_hits = 0
+        self._pending_spills = {}  # key -> layer queued for writing
+        self._spill_bytes = None  # Size of spill_dir, only touched by the spill thread
+        self._spill_pool = None
+
+    def get_or_create(self, params: dict, factory) -> Image.Image:
+        """
+        Returns the layer described by `params`, calling `factory()` to build
+        it on a miss. The result is shared, so callers must not modify it.
+        """
+        key = content_key(params)
+        layer = self._get(key)
+        if layer is not None:
+            return layer
+
+        with self._lock:
+            layer = self._pending_spills.get(key)
+        spill_path = self.spill_dir / f"{key}.png" if self.spill_dir else None
+        if layer is not None:
+            pass  # Evicted but not written out yet
+        elif spill_path is not None and spill_path.exists():
+            try:
+                layer = read_stored_image(spill_path)
+                with self._lock:
+                    self.disk_hits += 1
+            except FileNotFoundError:
+                layer = factory()  # Pruned meanwhile
+        else:
+            layer = factory()
+        self._put(key, layer, layer.width * layer.height * 4)
+        return layer
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["disk_hits"] = self.disk_hits
+        return stats
+
+    def _on_evict(self, key, value):
+        if self.spill_dir is None:
+            return
+        # Hand the write to the spill thread so the evicting render doesn't wait on it
+        with self._lock:
+            if key in self._pending_spills:
+                return
+            self._pending_spills[key] = value
+            if self._spill_pool is None:
+                self._spill_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="effect-spill")
+            spill_pool = self._spill_pool
+        spill_pool.submit(self._spill, key, value)
+
+    def _spill(self, key, value):
+        try:
+            spill_path = self.spill_dir / f"{key}.png"
+            if spill_path.exists():
+                return
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            write_atomically(spill_path, lambda temp_path: value.save(temp_path, "PNG", compress_level=1))
+
+            if self._spill_bytes is None:
+                self._spill_bytes = sum(
+                    entry.stat().st_size for entry in os.scandir(self.spill_dir) if entry.is_file()
+                )
+            else:
+                self._spill_bytes += spill_path.stat().st_size
+            if self._spill_bytes > self.spill_max_bytes:
+                prune_directory(self.spill_dir, self.spill_max_bytes)
+                self._spill_bytes = None  # Recounted on the next spill
+        except OSError as e:
+            print(f"⚠️ Could not spill effect layer {key}: {e}")
+        finally:
+            with self._lock:
+                self._pending_spills.pop(key, None)
+
+
+class TextMetricsCache(AssetCache):
+    """
+    Cached text measurements, so the same line in the same font and size is
+    measured once rather than on every page of every book.
+
+    Measurements match `ImageDraw.textlength` and the height of
+    `ImageDraw.textbbox` at the origin, as used for laying out text boxes.
+
+    Args:
+        max_bytes: Budget counted by the length of the cached strings.
+    """
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        super().__init__(max_bytes=max_bytes)
+        self._draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+
+    def measure(self, font, text: str) -> tuple:
+        """Returns (width, height) of one line of `text` in `font`."""
+        key = ("measure", self._font_key(font), text)
+        metrics = self._get(key)
+        if metrics is None:
+            bbox = self._draw.textbbox((0, 0), text, font=font)
+            metrics = (self._draw.textlength(text, font=font), bbox[3] - bbox[1])
+            self._put(key, metrics, self._entry_size(text))
+        return metrics
+
+    def wrap(self, font, text: str, max_width: float) -> tuple:
+        """
+        Greedily breaks one line of `text` at spaces so each piece fits in
+        `max_width`. Words wider than `max_width` get a line of their own.
+        """
+        key = ("wrap", self._font_key(font), text, max_width)
+        lines = self._get(key)
+        if lines is None:
+            lines = []
+            for word in text.split():
+                candidate = f"{lines[-1]} {word}" if lines else word
+                if lines and self.measure(font, candidate)[0] <= max_width:
+                    lines[-1] = candidate
+                else:
+                    lines.append(word)
+            lines = tuple(lines) or ("",)
+            self._put(key, lines, 2 * self._entry_size(text))
+        return lines
+
+    def _entry_size(self, text: str) -> int:
+        # Key tuple, string objects and result, not just the characters
+        return 2 * len(text) + 256
+
+    def _font_key(self, font) -> tuple:
+        """
+        Stable identity for a font's metrics: its file, modification time and
+        size. Fonts without a file path (Pillow's built-in font is loaded from
+        memory) share one "default" identity, so keys never hold font objects.
+        """
+        path = getattr(font, "path", None)
+        size = getattr(font, "size", None)
+        if isinstance(path, (str, os.PathLike)):
+            try:
+                return (os.fspath(path), os.stat(path).st_mtime_ns, size)
+            except OSError:
+                pass
+        return ("default", type(font).__name__, size)
+
+
+# One cache per process, shared by every compositor in it
+shared_asset_cache = AssetCache(
+    max_bytes=int(os.getenv("ASSET_CACHE_MAX_MB", "512")) * 1024 * 1024
+)
+
+# The single effect cache configuration, used by the API and the compositor CLI alike
+shared_effect_cache = EffectCache(
+    max_bytes=int(os.getenv("EFFECT_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    spill_dir=os.getenv("EFFECT_CACHE_DIR") or Path(__file__).resolve().parent / "assets" / "effect_cache",
+    spill_max_bytes=int(os.getenv("EFFECT_SPILL_MAX_MB", "1024")) * 1024 * 1024
+)
+
+shared_text_cache = TextMetricsCache(
+    max_bytes=int(os.getenv("TEXT_CACHE_MAX_MB", "16")) * 1024 * 1024
+)
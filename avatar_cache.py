@@ -0,0 +1,149 @@
+# avatar_cache.py
+"""
+Content-addressed cache of finished avatar generations.
+
+Generating poses takes minutes of OpenAI calls, and parents often upload the
+same photo again. Results are keyed by a hash of the normalized photo plus a
+hash of the prompt config, so a repeat upload with unchanged prompts gets
+its pose URLs back immediately.
+
+The index is a JSON file next to the generated sessions, so hits survive
+restarts. Entries expire once unused for a TTL, and the least recently used
+entries are dropped once the sessions they point at exceed the budget. The
+cache only ever drops index entries: session files stay, because clients
+may still hold their pose URLs.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from asset_cache import write_atomically
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def directory_size(path: Path) -> int:
+    return sum(entry.stat().st_size for entry in Path(path).rglob("*") if entry.is_file())
+
+
+class AvatarResultCache:
+    """
+    Thread-safe, disk-backed cache from (photo, prompt config) to a finished
+    generation's result.
+
+    Args:
+        index_path: JSON file holding the cache index.
+        ttl_seconds: How long an unused entry stays valid; 0 disables the cache.
+        max_bytes: Budget for the sessions the index points at; the least
+            recently used entries are dropped beyond it.
+    """
+    def __init__(self, index_path: str, ttl_seconds: float = 7 * 24 * 3600, max_bytes: int = 2 * 1024 ** 3):
+        self.index_path = Path(index_path)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = self._load_index()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def key(self, photo_path: str, config_path: str) -> str:
+        """Cache key for a normalized photo generated with the prompt config at `config_path`."""
+        return hashlib.sha256(
+            f"{file_digest(photo_path)}:{file_digest(config_path)}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> dict:
+        """Returns the cached result for `key`, or None if missing, expired or its files are gone."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_valid(entry):
+                entry["last_used"] = time.time()
+                self.hits += 1
+                self._save_index()
+                return entry["result"]
+            if entry is not None:
+                self._evict(key)
+                self._save_index()
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: dict, session_dir: str, pose_paths: list):
+        """Records a finished generation whose files live in `session_dir`."""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "result": result,
+                "session_dir": str(session_dir),
+                "pose_paths": [str(path) for path in pose_paths],
+                "bytes": directory_size(session_dir),
+                "created_at": now,
+                "last_used": now,
+            }
+            self._enforce_limits()
+            self._save_index()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry["bytes"] for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def _is_valid(self, entry: dict) -> bool:
+        if time.time() - entry["last_used"] > self.ttl_seconds:
+            return False
+        return all(os.path.exists(path) for path in entry["pose_paths"])
+
+    def _enforce_limits(self):
+        for key in [key for key, entry in self._entries.items() if not self._is_valid(entry)]:
+            self._evict(key)
+        total_bytes = sum(entry["bytes"] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_used"]):
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= self._entries[key]["bytes"]
+            self._evict(key)
+
+    def _evict(self, key: str):
+        # Only forget the entry; the session's files may still be in use
+        self._entries.pop(key)
+        self.evictions += 1
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self):
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomically(
+            self.index_path, lambda temp_path: temp_path.write_text(json.dumps(self._entries), encoding="utf-8")
+        )
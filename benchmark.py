@@ -0,0 +1,387 @@
+# benchmark.py
+"""
+Benchmarks for the compositor and sprite-processing hot paths.
+
+Builds synthetic templates, sprite sheets and composition configs in a
+temporary directory, runs every case in a fresh process so peak RSS is
+measured per case, and writes the results as JSON for comparing commits.
+
+Usage:
+    python benchmark.py [--repeat N] [--output bench_output.txt]
+                        [--only CASE ...] [--compare previous.json]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# (width, height) of the synthetic images each case works on
+SINGLE_SPRITE_SIZE = (1024, 1024)
+SPRITE_SHEET_SIZE = (1536, 1024)
+WEB_PAGE_SIZE = (1536, 1024)
+PRINT_PAGE_SIZE = (3508, 2480)  # A4 landscape at 300 dpi
+STORY_PAGES = 4
+FONT_CANDIDATES = (
+    "assets/fonts/default.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+)
+
+COMPOSITOR_STAGES = (
+    "_load_template", "_build_sprite_layer", "_create_layer_shadow", "_create_layer_glow",
+    "_apply_layer", "_draw_text_boxes", "_encode_page",
+)
+SPRITE_STAGES = (
+    "load_image_array", "remove_white_background", "decontaminate_edges",
+    "find_sprites_in_sheet", "crop_sprite_tight",
+)
+
+
+# --- Synthetic Assets ---
+def draw_figure(draw: ImageDraw.ImageDraw, box: tuple, seed: int):
+    """Draws a soft-edged cartoon figure (body, head, arms) inside `box` on a white background."""
+    rng = np.random.default_rng(seed)
+    x0, y0, x1, y1 = box
+    width, height = x1 - x0, y1 - y0
+    color = tuple(int(c) for c in rng.integers(40, 200, size=3))
+    skin = (235, 190, 160)
+    draw.ellipse((x0 + width * 0.3, y0 + height * 0.05, x0 + width * 0.7, y0 + height * 0.35), fill=skin)
+    draw.rounded_rectangle((x0 + width * 0.25, y0 + height * 0.35, x0 + width * 0.75, y0 + height * 0.8),
+                           radius=int(width * 0.1), fill=color)
+    draw.line((x0 + width * 0.25, y0 + height * 0.45, x0 + width * 0.05, y0 + height * 0.6), fill=color, width=int(width * 0.08))
+    draw.line((x0 + width * 0.75, y0 + height * 0.45, x0 + width * 0.95, y0 + height * 0.6), fill=color, width=int(width * 0.08))
+    draw.rectangle((x0 + width * 0.3, y0 + height * 0.8, x0 + width * 0.45, y0 + height * 0.97), fill=(60, 60, 90))
+    draw.rectangle((x0 + width * 0.55, y0 + height * 0.8, x0 + width * 0.7, y0 + height * 0.97), fill=(60, 60, 90))
+
+
+def make_sprite_image(size: tuple, figures: int, seed: int = 0) -> bytes:
+    """Returns PNG bytes of `figures` figures side by side on white, like a model-generated sheet."""
+    image = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    slot = size[0] // figures
+    for i in range(figures):
+        margin = int(slot * 0.12)
+        draw_figure(draw, (i * slot + margin, margin, (i + 1) * slot - margin, size[1] - margin), seed + i)
+    # Antialias the edges the way generated images are
+    image = image.filter(ImageFilter.GaussianBlur(1.2))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_template(size: tuple, path: Path):
+    """Writes a gradient-and-shapes background template."""
+    width, height = size
+    gradient = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    sky = np.array([120, 180, 240], dtype=np.float32) * (1 - gradient) + np.array([250, 220, 170], dtype=np.float32) * gradient
+    pixels = np.broadcast_to(sky[:, None, :], (height, width, 3)).astype(np.uint8)
+    image = Image.fromarray(np.ascontiguousarray(pixels))
+    draw = ImageDraw.Draw(image)
+    rng = np.random.default_rng(width)
+    for _ in range(40):
+        cx, cy = rng.integers(0, width), rng.integers(height // 2, height)
+        r = int(rng.integers(width // 40, width // 10))
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=tuple(int(c) for c in rng.integers(30, 160, size=3)))
+    image.save(path)
+
+
+def make_story_config(page_size: tuple, pages: int, font: str) -> dict:
+    """A story config in the shape generate_story_config produces, scaled to `page_size`."""
+    width, height = page_size
+    scale = width / 1536
+    config = {}
+    for i in range(pages):
+        config[f"page_{i + 1:02d}"] = {
+            "template_file": f"bench/{width}x{height}.png",
+            "layers": [
+                {
+                    "filename": "bench_sprite.png",
+                    "position": [int(width * 0.1) + i * 10, int(height * 0.25)],
+                    "scale": 0.6 * scale,
+                    "edge_blur": 2,
+                    "enable_layer_shadow": True,
+                    "layer_shadow_offset": [int(8 * scale), int(8 * scale)],
+                    "layer_shadow_blur": 8 * scale,
+                    "enable_layer_glow": True,
+                    "layer_glow_color": [255, 230, 150],
+                    "layer_glow_radius": 15 * scale,
+                },
+                {
+                    "filename": "bench_sprite.png",
+                    "type": "circular_crop",
+                    "size": int(300 * scale),
+                    "position": [int(width * 0.7), int(height * 0.1)],
+                    "enable_layer_glow": True,
+                    "layer_glow_radius": 12 * scale,
+                },
+            ],
+            "text_boxes": [
+                {
+                    "x": int(width * 0.05), "y": int(height * 0.05),
+                    "width": int(width * 0.55), "height": int(height * 0.18),
+                    "text": f"Once upon a time, Ava set off on adventure number {i + 1}!||Every page is a new surprise.",
+                    "font": font,
+                    "font_size": int(44 * scale),
+                    "align": "center",
+                    "opacity": 0.35,
+                    "enable_glow": True,
+                    "glow_radius": 18 * scale,
+                    "glow_color": [255, 215, 0],
+                    "enable_shadow": True,
+                    "shadow_blur": 3 * scale,
+                    "stroke_width": max(1, int(2 * scale)),
+                    "stroke_color": [0, 0, 0],
+                },
+            ],
+        }
+    return config
+
+
+def build_workspace(root: Path) -> dict:
+    """Creates every synthetic input under `root` and returns their locations."""
+    base_dir = root / "assets"
+    for sub in ("story_templates/bench", "story_sprites", "fonts", "story_final"):
+        (base_dir / sub).mkdir(parents=True, exist_ok=True)
+
+    font_name = "default.ttf"
+    font_source = next((Path(p) for p in FONT_CANDIDATES if Path(p).exists()), None)
+    if font_source is not None:
+        shutil.copyfile(font_source, base_dir / "fonts" / font_name)
+
+    for size in (WEB_PAGE_SIZE, PRINT_PAGE_SIZE):
+        make_template(size, base_dir / "story_templates" / "bench" / f"{size[0]}x{size[1]}.png")
+
+    single = make_sprite_image(SINGLE_SPRITE_SIZE, figures=1, seed=1)
+    sheet = make_sprite_image(SPRITE_SHEET_SIZE, figures=3, seed=2)
+    (root / "single.png").write_bytes(single)
+    (root / "sheet.png").write_bytes(sheet)
+
+    # The composition sprite is the matted single figure, as the API copies it in
+    from story_pose_generator import SpriteProcessor
+    SpriteProcessor().process_single_sprite(single).save(base_dir / "story_sprites" / "bench_sprite.png")
+
+    return {
+        "base_dir": str(base_dir),
+        "single": str(root / "single.png"),
+        "sheet": str(root / "sheet.png"),
+        "font": str(font_source) if font_source is not None else "builtin",
+        "configs": {
+            "web": make_story_config(WEB_PAGE_SIZE, STORY_PAGES, font_name),
+            "print": make_story_config(PRINT_PAGE_SIZE, STORY_PAGES, font_name),
+        },
+    }
+
+
+# --- Measurement ---
+def instrument(obj, method_names: tuple, totals: dict):
+    """
+    Wraps the named methods on one instance to add their wall time into
+    `totals`. Times are inclusive, so a stage that calls another counts both.
+    """
+    for name in method_names:
+        original = getattr(obj, name, None)
+        if original is None:
+            continue
+
+        def timed(*args, _original=original, _name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                totals[_name] = totals.get(_name, 0.0) + time.perf_counter() - start
+
+        setattr(obj, name, timed)
+
+
+def case_sprite_single(workspace: dict, totals: dict):
+    from story_pose_generator import SpriteProcessor
+    processor = SpriteProcessor()
+    instrument(processor, SPRITE_STAGES, totals)
+    image_bytes = Path(workspace["single"]).read_bytes()
+    return lambda: processor.process_single_sprite(image_bytes)
+
+
+def case_sprite_sheet(workspace: dict, totals: dict):
+    from story_pose_generator import SpriteProcessor
+    processor = SpriteProcessor()
+    instrument(processor, SPRITE_STAGES, totals)
+    image_bytes = Path(workspace["sheet"]).read_bytes()
+    return lambda: processor.process_sprite_sheet(image_bytes)
+
+
+def case_remove_white_background(workspace: dict, totals: dict):
+    from story_pose_generator import SpriteProcessor
+    processor = SpriteProcessor()
+    image_array = processor.load_image_array(workspace["single"])
+    instrument(processor, ("decontaminate_edges",), totals)
+    # The matte is written into RGBA input arrays, so every run needs a fresh copy
+    return lambda: processor.remove_white_background(image_array.copy())
+
+
+def _compositor(workspace: dict, totals: dict):
+    from compositor import StoryCompositor
+    from asset_cache import AssetCache, EffectCache, TextMetricsCache
+    # Private caches so one case never warms another; no page reuse, so
+    # every run really renders
+    compositor = StoryCompositor(
+        base_dir=workspace["base_dir"], asset_cache=AssetCache(), effect_cache=EffectCache(),
+        text_cache=TextMetricsCache(), page_workers=1, reuse_pages=False,
+    )
+    instrument(compositor, COMPOSITOR_STAGES, totals)
+    return compositor
+
+
+def _compose_case(page_set: str, warm: bool):
+    def case(workspace: dict, totals: dict):
+        compositor = _compositor(workspace, totals)
+        config = workspace["configs"][page_set]
+        output_dir = Path(workspace["base_dir"]) / "story_final" / f"{page_set}_{os.getpid()}"
+
+        def run():
+            if not warm:
+                compositor.asset_cache.clear()
+                compositor.effect_cache.clear()
+                compositor.text_cache.clear()
+            return compositor.run(config, output_dir)
+
+        if warm:
+            # Prime the caches outside the measured runs
+            compositor.run(config, output_dir)
+            totals.clear()
+        return run
+    return case
+
+
+def case_draw_text_boxes(workspace: dict, totals: dict):
+    compositor = _compositor(workspace, totals)
+    settings = workspace["configs"]["print"]["page_01"]
+    template = Image.new("RGBA", PRINT_PAGE_SIZE, (90, 140, 200, 255))
+    boxes = settings["text_boxes"] * 3
+    return lambda: compositor._draw_text_boxes(template.copy(), boxes)
+
+
+CASES = {
+    "sprite_single_1024": case_sprite_single,
+    "sprite_sheet_1536x1024": case_sprite_sheet,
+    "remove_white_background_1024": case_remove_white_background,
+    "compose_web_cold": _compose_case("web", warm=False),
+    "compose_web_warm": _compose_case("web", warm=True),
+    "compose_print_cold": _compose_case("print", warm=False),
+    "compose_print_warm": _compose_case("print", warm=True),
+    "draw_text_boxes_print": case_draw_text_boxes,
+}
+
+
+def run_case(name: str, workspace: dict, repeat: int) -> dict:
+    """Runs one case `repeat` times. Meant to execute in a fresh process."""
+    totals = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = CASES[name](workspace, totals)
+        setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        wall_times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            wall_times.append(time.perf_counter() - start)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "wall_seconds": {
+            "min": round(min(wall_times), 4),
+            "median": round(statistics.median(wall_times), 4),
+            "runs": [round(t, 4) for t in wall_times],
+        },
+        "peak_rss_mb": round(peak_rss * rss_unit / (1024 * 1024), 1),
+        "setup_rss_mb": round(setup_rss * rss_unit / (1024 * 1024), 1),
+        "stages": {stage: round(seconds / repeat, 4) for stage, seconds in sorted(totals.items())},
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: dict, previous: dict = None):
+    print(f"\n{'case':<32}{'median s':>10}{'min s':>10}{'peak MB':>10}{'vs prev':>10}")
+    for name, case in results["cases"].items():
+        change = ""
+        if previous and name in previous.get("cases", {}):
+            before = previous["cases"][name]["wall_seconds"]["median"]
+            if before:
+                change = f"{case['wall_seconds']['median'] / before:.2f}x"
+        print(f"{name:<32}{case['wall_seconds']['median']:>10.3f}{case['wall_seconds']['min']:>10.3f}"
+              f"{case['peak_rss_mb']:>10.1f}{change:>10}")
+        for stage, seconds in case["stages"].items():
+            print(f"    {stage:<28}{seconds:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compositor and sprite processing.")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured runs per case (default 3)")
+    parser.add_argument("--output", default="bench_output.txt", help="Where to write the JSON results")
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES), help="Run only these cases")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    # Cases import the modules relative to the repo, wherever this is run from
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+
+    names = args.only or list(CASES)
+    with tempfile.TemporaryDirectory(prefix="mitra_bench_") as temp_dir:
+        print(f"🧪 Building synthetic assets in {temp_dir}...")
+        workspace = build_workspace(Path(temp_dir))
+        cases = {}
+        for name in names:
+            print(f"⏱️  {name}...")
+            # A fresh interpreter per case keeps caches and peak RSS independent
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                cases[name] = pool.submit(run_case, name, workspace, args.repeat).result()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "font": workspace["font"],
+        "cases": cases,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+    print_report(results, previous)
+    print(f"\n✅ Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
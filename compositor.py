@@ -1,22 +1,107 @@
 # compositor.py (Updated for Layer Glows and Highlights)
 
+import os
 import sys
+import math
 import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
+from PIL import Image, ImageDraw, ImageFilter, ImageEnhance
+from metrics import timed
+from asset_cache import (
+    AssetCache, EffectCache, TextMetricsCache, content_key, prune_directory,
+    write_atomically, mark_used, read_stored_image,
+    shared_asset_cache, shared_effect_cache, shared_text_cache
+)
+
+IMAGE_FALLBACK_EXTS = ('.jpg', '.jpeg', '.png')
+# Part of every page fingerprint; bump when a change to the rendering code
+# alters output, so previously stored pages are not reused
+RENDERER_VERSION = 1
+# How pages are encoded when a job doesn't ask for anything else (Pillow's PNG defaults)
+DEFAULT_OUTPUT_OPTIONS = {
+    "format": "png",
+    "compress_level": 6,    # PNG: 0 (fastest, largest) to 9 (slowest, smallest)
+    "quality": 90,          # JPEG/WebP
+    "progressive": False,   # JPEG
+    "lossless": False,      # WebP
+    "preview_widths": [],   # Extra downscaled renditions, e.g. [480, 1024]
+}
+OUTPUT_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+# Pixel-sized settings rescaled for reduced-resolution renders, with the
+# defaults the renderer uses when a setting is missing (None: required)
+LAYER_PIXEL_SETTINGS = {
+    "position": None,
+    "layer_shadow_offset": [5, 5],
+    "layer_shadow_blur": 5,
+    "layer_glow_radius": 15,
+}
+TEXT_BOX_PIXEL_SETTINGS = {
+    "x": None, "y": None, "width": None, "height": None,
+    "font_size": 24,
+    "min_font_size": 8,
+    "corner_radius": 15,
+    "glow_radius": 15,
+    "line_spacing": 10,
+    "padding": 10,
+    "offset": 0,
+    "shadow_offset": [2, 2],
+    "shadow_blur": 3,
+    "stroke_width": 0,
+}
 
 class StoryCompositor:
     """
     A class to handle the composition of story pages from assets.
+
+    Can be driven from the command line with a config file on disk, or kept
+    alive as a library object and handed a config dict per call to `run`.
     """
-    def __init__(self, config_path: str):
-        self.config_path = Path(config_path)
-        self.config = self._load_config()
-        self.base_dir = self.config_path.parent
+    def __init__(self, config_path: str = None, config: dict = None, base_dir: str = None,
+                 asset_cache: AssetCache = None, page_workers: int = None,
+                 effect_cache: EffectCache = None, reuse_pages: bool = True,
+                 text_cache: TextMetricsCache = None, page_store_max_bytes: int = None,
+                 flattened_store_max_bytes: int = None):
+        self.config_path = Path(config_path) if config_path else None
+        if config is not None:
+            self.config = config
+        elif self.config_path is not None:
+            self.config = self._load_config()
+        else:
+            self.config = {}
+        if base_dir is not None:
+            self.base_dir = Path(base_dir)
+        elif self.config_path is not None:
+            self.base_dir = self.config_path.parent
+        else:
+            self.base_dir = Path("assets")
         self.templates_dir = self.base_dir / "story_templates"
         self.sprites_dir = self.base_dir / "story_sprites"
         self.fonts_dir = self.base_dir / "fonts"
         self.output_dir = self.base_dir / "story_final"
+        # Decoded templates, sprites and fonts, shared across compositions in this process
+        self.asset_cache = asset_cache if asset_cache is not None else shared_asset_cache
+        # Prepared sprites, shadows and glows keyed by source content + settings
+        self.effect_cache = effect_cache if effect_cache is not None else shared_effect_cache
+        # Line measurements and word wraps per font, size and text
+        self.text_cache = text_cache if text_cache is not None else shared_text_cache
+        # Rendered pages keyed by input fingerprint, so unchanged pages are reused
+        self.reuse_pages = reuse_pages
+        self.page_store_dir = self.base_dir / "rendered_pages"
+        # Disk budget for stored pages; the least recently used ones are deleted beyond it
+        self.page_store_max_bytes = page_store_max_bytes or int(os.getenv("PAGE_STORE_MAX_MB", "1024")) * 1024 * 1024
+        # Templates with their static decorations already drawn (see preflatten)
+        self.flattened_store_dir = self.base_dir / "flattened_templates"
+        # Disk budget for flattened bases; versions no page uses any more age out first
+        self.flattened_store_max_bytes = (
+            flattened_store_max_bytes or int(os.getenv("FLATTENED_STORE_MAX_MB", "512")) * 1024 * 1024
+        )
+        # Pages rendered in parallel per run (Pillow releases the GIL for filters and encodes)
+        self.page_workers = page_workers or int(os.getenv("COMPOSE_PAGE_WORKERS", "1"))
+        self._page_pools = {}
+        self._page_pools_lock = threading.Lock()
         self._validate_directories()
 
     def _load_config(self) -> dict:
@@ -37,19 +122,86 @@ class StoryCompositor:
         self.output_dir.mkdir(parents=True, exist_ok=True)
         print(f"✅ Output directory is ready at: '{self.output_dir}'")
 
-    def _find_and_open_image(self, path: Path) -> Image.Image:
-        """Finds and opens an image, trying common extensions."""
-        if path.exists():
-            return Image.open(path).convert("RGBA")
-
-        base = path.with_suffix('')
-        for ext in ('.jpg', '.jpeg', '.png'):
-            new_path = base.with_suffix(ext)
-            if new_path.exists():
-                print(f"   - INFO: '{path.name}' not found, using '{new_path.name}' instead.")
-                return Image.open(new_path).convert("RGBA")
-        
-        raise FileNotFoundError(f"Cannot find {base.name} with .jpg, .jpeg, or .png extension.")
+    def _find_and_open_image(self, path: Path, shared: bool = False) -> Image.Image:
+        """
+        Finds and opens an image, trying common extensions.
+        Decoded images come from the asset cache; pass shared=True only if the
+        result will not be modified, otherwise a private copy is returned.
+        """
+        image = self.asset_cache.get_image(path, fallback_exts=IMAGE_FALLBACK_EXTS)
+        return image if shared else image.copy()
+
+    @timed("compositor", "template_load")
+    def _load_template(self, settings: dict) -> Image.Image:
+        """
+        Returns a private copy of the page's template at its render scale.
+        Downscaled templates are kept in the effect cache, so previews don't
+        resize the full-resolution template every time.
+        """
+        template_path = self.templates_dir / settings['template_file']
+        render_scale = settings.get('render_scale', 1.0)
+        if render_scale == 1.0:
+            return self._find_and_open_image(template_path)
+
+        def downscale_template() -> Image.Image:
+            template = self._find_and_open_image(template_path, shared=True)
+            size = (max(1, round(template.width * render_scale)), max(1, round(template.height * render_scale)))
+            return template.resize(size, Image.Resampling.LANCZOS)
+
+        template_key = {
+            "template": self.asset_cache.get_digest(template_path, fallback_exts=IMAGE_FALLBACK_EXTS),
+            "render_scale": render_scale,
+        }
+        return self.effect_cache.get_or_create(template_key, downscale_template).copy()
+
+    def _scale_page_settings(self, settings: dict, render_scale: float) -> dict:
+        """
+        Returns page settings for rendering at `render_scale` of the template's
+        resolution: positions, sizes, font sizes, offsets and blur radii are all
+        scaled, and sprites are scaled through their own `scale` setting.
+        """
+        def scaled(value, default):
+            value = default if value is None else value
+            if isinstance(value, (list, tuple)):
+                return [round(v * render_scale) for v in value]
+            return round(value * render_scale, 2)
+
+        layers = []
+        for layer in settings.get('layers', []):
+            layer = dict(layer)
+            for key, default in LAYER_PIXEL_SETTINGS.items():
+                layer[key] = scaled(layer.get(key), default)
+            layer['scale'] = layer.get('scale', 1.0) * render_scale
+            layers.append(layer)
+
+        text_boxes = []
+        for box in settings.get('text_boxes', []):
+            box = dict(box)
+            for key, default in TEXT_BOX_PIXEL_SETTINGS.items():
+                box[key] = scaled(box.get(key), default)
+            for key in ('x', 'y', 'width', 'height'):
+                box[key] = round(box[key])
+            # Fonts and strokes need whole pixels; keep thin strokes visible
+            box['font_size'] = max(1, round(box['font_size']))
+            box['min_font_size'] = max(1, round(box['min_font_size']))
+            if box['stroke_width'] > 0:
+                box['stroke_width'] = max(1, round(box['stroke_width']))
+            text_boxes.append(box)
+
+        return {
+            **settings,
+            "layers": layers,
+            "text_boxes": text_boxes,
+            "render_scale": settings.get('render_scale', 1.0) * render_scale,
+        }
+
+    def _load_font(self, font_name: str, size: int):
+        """Loads a font from the fonts directory via the asset cache, falling back to the default font."""
+        try:
+            return self.asset_cache.get_font(self.fonts_dir / font_name, size)
+        except IOError:
+            return self.asset_cache.get_default_font()
+
     def _apply_edge_blur(self, image: Image.Image, radius: int) -> Image.Image:
         if radius <= 0: return image
         alpha = image.getchannel('A')
@@ -82,27 +234,51 @@ class StoryCompositor:
         if rotation != 0: image = image.rotate(rotation, expand=True, resample=Image.BICUBIC)
         return image
 
+    def _blur_padding(self, radius: float) -> int:
+        """
+        How far (in pixels) a GaussianBlur of `radius` can spread content.
+        Pillow approximates the blur with three box-blur passes of at most
+        `radius` each, so content never reaches further than this.
+        """
+        return 3 * (math.ceil(radius) + 1) + 2
+
+    def _padded_region(self, bbox: tuple, padding: int, canvas_size: tuple):
+        """Returns `bbox` grown by `padding` and clipped to the canvas, or None if nothing is left."""
+        x0 = max(0, math.floor(bbox[0]) - padding)
+        y0 = max(0, math.floor(bbox[1]) - padding)
+        x1 = min(canvas_size[0], math.ceil(bbox[2]) + padding)
+        y1 = min(canvas_size[1], math.ceil(bbox[3]) + padding)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (x0, y0, x1, y1)
+
+    @timed("compositor", "text")
     def _draw_text_boxes(self, canvas: Image.Image, text_boxes: list) -> Image.Image:
-        # ... (no changes in this function) ...
+        # Glows and shadows are built only around the box or line they belong
+        # to (padded by the blur reach) and composited back in place
         for box in text_boxes:
-            temp_canvas = canvas.copy()
             if box.get('enable_glow', False):
-                mask = Image.new('L', temp_canvas.size, 0)
-                mask_draw = ImageDraw.Draw(mask)
                 rect = (box['x'], box['y'], box['x'] + box['width'], box['y'] + box['height'])
                 corner_radius = box.get('corner_radius', 15)
-                mask_draw.rounded_rectangle(rect, radius=corner_radius, fill=255)
                 glow_radius = box.get('glow_radius', 15)
-                if glow_radius > 0:
-                    blurred_mask = mask.filter(ImageFilter.GaussianBlur(radius=glow_radius))
-                else:
-                    blurred_mask = mask
-                glow_color = tuple(box.get('glow_color', [255, 255, 255]))
-                color_layer = Image.new('RGBA', temp_canvas.size, glow_color)
-                color_layer.putalpha(blurred_mask)
-                temp_canvas = Image.alpha_composite(temp_canvas, color_layer)
-
-            final_draw = ImageDraw.Draw(temp_canvas, 'RGBA')
+                padding = self._blur_padding(glow_radius) if glow_radius > 0 else 1
+                region = self._padded_region(rect, padding, canvas.size)
+                if region is not None:
+                    x0, y0, x1, y1 = region
+                    mask = Image.new('L', (x1 - x0, y1 - y0), 0)
+                    mask_draw = ImageDraw.Draw(mask)
+                    local_rect = (rect[0] - x0, rect[1] - y0, rect[2] - x0, rect[3] - y0)
+                    mask_draw.rounded_rectangle(local_rect, radius=corner_radius, fill=255)
+                    if glow_radius > 0:
+                        blurred_mask = mask.filter(ImageFilter.GaussianBlur(radius=glow_radius))
+                    else:
+                        blurred_mask = mask
+                    glow_color = tuple(box.get('glow_color', [255, 255, 255]))
+                    color_layer = Image.new('RGBA', mask.size, glow_color)
+                    color_layer.putalpha(blurred_mask)
+                    canvas.alpha_composite(color_layer, dest=(x0, y0))
+
+            final_draw = ImageDraw.Draw(canvas, 'RGBA')
             rect = (box['x'], box['y'], box['x'] + box['width'], box['y'] + box['height'])
             opacity = box.get('opacity', 0.0)
             if opacity > 0:
@@ -110,19 +286,9 @@ class StoryCompositor:
                 corner_radius = box.get('corner_radius', 15)
                 final_draw.rounded_rectangle(rect, radius=corner_radius, fill=box_color)
 
-            try:
-                font_path = str(self.fonts_dir / box.get('font', 'default.ttf'))
-                font = ImageFont.truetype(font_path, size=box.get('font_size', 24))
-            except IOError:
-                font = ImageFont.load_default()
-
-            text = box.get('text', '')
-            lines = [line.strip() for line in text.split('||')]
+            font, lines, line_widths, line_heights, total_text_height = self._layout_text_box(box)
             line_spacing = box.get('line_spacing', 10)
-            
-            line_heights = [final_draw.textbbox((0,0), line, font=font)[3] - final_draw.textbbox((0,0), line, font=font)[1] for line in lines]
-            total_text_height = sum(line_heights) + max(0, len(lines) - 1) * line_spacing
-            
+
             align = box.get('align', 'left')
             padding = box.get('padding', 10)
             box_x, box_y, box_width, box_height = rect[0], rect[1], box['width'], box['height']
@@ -137,8 +303,7 @@ class StoryCompositor:
 
             for i, line in enumerate(lines):
                 if align == 'center':
-                    line_width = final_draw.textlength(line, font=font)
-                    current_x = box_x + (box_width - line_width) / 2
+                    current_x = box_x + (box_width - line_widths[i]) / 2
                 else: 
                     current_x = box_x + padding
                 
@@ -150,12 +315,17 @@ class StoryCompositor:
                     shadow_blur = box.get('shadow_blur', 3)
                     shadow_pos = (position[0] + shadow_offset[0], position[1] + shadow_offset[1])
                     
-                    shadow_layer = Image.new('RGBA', temp_canvas.size, (0,0,0,0))
-                    shadow_draw = ImageDraw.Draw(shadow_layer)
-                    shadow_draw.text(shadow_pos, line, font=font, fill=shadow_color, anchor='lt')
-                    shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
-                    temp_canvas.paste(shadow_layer, (0,0), shadow_layer)
-                    final_draw = ImageDraw.Draw(temp_canvas)
+                    text_bbox = final_draw.textbbox(shadow_pos, line, font=font, anchor='lt')
+                    region = self._padded_region(text_bbox, self._blur_padding(shadow_blur), canvas.size)
+                    if region is not None:
+                        # Integer shift only, so glyphs rasterize exactly as on the full canvas
+                        x0, y0, x1, y1 = region
+                        shadow_layer = Image.new('RGBA', (x1 - x0, y1 - y0), (0,0,0,0))
+                        shadow_draw = ImageDraw.Draw(shadow_layer)
+                        local_pos = (shadow_pos[0] - x0, shadow_pos[1] - y0)
+                        shadow_draw.text(local_pos, line, font=font, fill=shadow_color, anchor='lt')
+                        shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
+                        canvas.paste(shadow_layer, (x0, y0), shadow_layer)
 
                 stroke_width = box.get('stroke_width', 0)
                 stroke_color = tuple(box.get('stroke_color', [255, 255, 255]))
@@ -164,13 +334,57 @@ class StoryCompositor:
                                 stroke_width=stroke_width, stroke_fill=stroke_color)
 
                 current_y += line_heights[i] + line_spacing
-            
-            canvas = temp_canvas
 
         return canvas
 
+    def _layout_text_box(self, box: dict) -> tuple:
+        """
+        Lays out a text box's lines from cached measurements.
+
+        Lines are split on '||'. With "wrap" they are also broken at spaces to
+        fit the box width inside its padding. With "fit" the font size is the
+        largest between "min_font_size" and "font_size" at which the text fits
+        the padded box, found by binary search.
+
+        Returns:
+            (font, lines, line_widths, line_heights, total_text_height)
+        """
+        font_name = box.get('font', 'default.ttf')
+        line_spacing = box.get('line_spacing', 10)
+        padding = box.get('padding', 10)
+        inner_width = box['width'] - 2 * padding
+        inner_height = box['height'] - 2 * padding
+        paragraphs = [line.strip() for line in box.get('text', '').split('||')]
+
+        def layout(font_size: int) -> tuple:
+            font = self._load_font(font_name, font_size)
+            lines = []
+            for paragraph in paragraphs:
+                if box.get('wrap', False):
+                    lines.extend(self.text_cache.wrap(font, paragraph, inner_width))
+                else:
+                    lines.append(paragraph)
+            metrics = [self.text_cache.measure(font, line) for line in lines]
+            line_widths = [width for width, _ in metrics]
+            line_heights = [height for _, height in metrics]
+            total_text_height = sum(line_heights) + max(0, len(lines) - 1) * line_spacing
+            return font, lines, line_widths, line_heights, total_text_height
+
+        font_size = box.get('font_size', 24)
+        if box.get('fit', False):
+            low, high = min(box.get('min_font_size', 8), font_size), font_size
+            font_size = low
+            while low <= high:
+                size = (low + high) // 2
+                _, _, line_widths, _, total_text_height = layout(size)
+                if max(line_widths) <= inner_width and total_text_height <= inner_height:
+                    font_size, low = size, size + 1
+                else:
+                    high = size - 1
+        return layout(font_size)
+
     def _create_circular_crop(self, image_path: Path, size: int) -> Image.Image:
-        img = self._find_and_open_image(image_path)
+        img = self._find_and_open_image(image_path, shared=True)
         img = img.resize((size, size), Image.Resampling.LANCZOS)
         mask = Image.new('L', (size, size), 0)
         draw = ImageDraw.Draw(mask)
@@ -179,8 +393,8 @@ class StoryCompositor:
         return img
     
     # --- NEW HELPER FUNCTION ---
-    def _create_layer_glow(self, canvas_size: tuple, layer: Image.Image, position: tuple, settings: dict) -> Image.Image:
-        """Creates a blurred glow effect for a given layer."""
+    def _create_layer_glow(self, layer: Image.Image, settings: dict) -> Image.Image:
+        """Creates a blurred glow effect for a given layer, the same size as the layer."""
         # Create a mask from the layer's alpha channel
         mask = layer.getchannel('A')
         
@@ -196,81 +410,477 @@ class StoryCompositor:
         if glow_radius > 0:
             glow_layer = glow_layer.filter(ImageFilter.GaussianBlur(radius=glow_radius))
         
-        # Create a full-size canvas for the glow to composite it correctly
-        final_glow_canvas = Image.new('RGBA', canvas_size, (0,0,0,0))
-        final_glow_canvas.paste(glow_layer, position, glow_layer)
+        # Mask the glow by its own alpha over transparency, as pasting it onto
+        # an empty layer does, so it composites correctly
+        final_glow_layer = Image.new('RGBA', layer.size, (0,0,0,0))
+        final_glow_layer.paste(glow_layer, (0, 0), glow_layer)
         
-        return final_glow_canvas
-
-    def run(self):
-        """Executes the main composition logic for all pages in the config."""
-        print("\n" + "="*50 + "\n🚀 Starting Story Page Composition Process\n" + "="*50)
-        for page_name, settings in self.config.items():
+        return final_glow_layer
+
+    def _alpha_composite_at(self, canvas: Image.Image, overlay: Image.Image, position: tuple):
+        """
+        Alpha-composites `overlay` onto `canvas` in place with its top-left at
+        `position`, touching only the overlapping region. Parts of the overlay
+        outside the canvas (including negative offsets) are dropped.
+        """
+        x, y = position
+        left, top = max(0, -x), max(0, -y)
+        right = min(overlay.width, canvas.width - x)
+        bottom = min(overlay.height, canvas.height - y)
+        if left >= right or top >= bottom:
+            return
+        canvas.alpha_composite(overlay, dest=(x + left, y + top), source=(left, top, right, bottom))
+
+    def _sprite_effect_key(self, layer_data: dict) -> dict:
+        """
+        Describes a layer's prepared sprite by the content hash of its source
+        file plus every setting that changes its pixels.
+        """
+        layer_type = layer_data.get('type', 'sprite')
+        sprite_path = self.sprites_dir / layer_data['filename']
+        return {
+            "source": self.asset_cache.get_digest(sprite_path, fallback_exts=IMAGE_FALLBACK_EXTS),
+            "type": layer_type,
+            "size": layer_data.get('size', 450) if layer_type == 'circular_crop' else None,
+            "edge_blur": layer_data.get('edge_blur', 0),
+            "brightness": layer_data.get("brightness", 1.0),
+            "contrast": layer_data.get("contrast", 1.0),
+            "scale": layer_data.get("scale", 1.0),
+            "flip": layer_data.get("flip", "none").lower(),
+            "rotation": layer_data.get("rotation", 0),
+        }
+
+    def _build_sprite_layer(self, layer_data: dict) -> Image.Image:
+        """Opens a layer's sprite and applies its crop, edge blur and transformations."""
+        # Step 1: Create the base sprite
+        layer_type = layer_data.get('type', 'sprite')
+        sprite_path = self.sprites_dir / layer_data['filename']
+        if layer_type == 'circular_crop':
+            crop_size = layer_data.get('size', 450)
+            sprite = self._create_circular_crop(sprite_path, crop_size)
+        else: # Default is 'sprite'
+            # Sprites are only read from (every effect makes a new image)
+            sprite = self._find_and_open_image(sprite_path, shared=True)
+
+        # Step 2: Apply edge blur to the sprite itself
+        blur_radius = layer_data.get('edge_blur', 0)
+        if blur_radius > 0:
+            sprite = self._apply_edge_blur(sprite, blur_radius)
+
+        # Step 3: Apply transformations (brightness, contrast, scale, etc.)
+        return self._apply_transformations(sprite, layer_data)
+
+    def _create_layer_shadow(self, layer: Image.Image, shadow_color: tuple, shadow_blur: float) -> Image.Image:
+        """Creates a blurred, colored silhouette of a layer for its drop shadow."""
+        # Create a colored silhouette from the sprite's alpha channel
+        alpha = layer.getchannel('A')
+        shadow_silhouette = Image.new('RGBA', layer.size, shadow_color)
+        shadow_silhouette.putalpha(alpha)
+        
+        # Blur the silhouette; the caller pastes it at an offset
+        return shadow_silhouette.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
+
+    def _get_page_pool(self, workers: int) -> ThreadPoolExecutor:
+        """Returns the long-lived page rendering pool for the given worker count."""
+        with self._page_pools_lock:
+            pool = self._page_pools.get(workers)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="page-render")
+                self._page_pools[workers] = pool
+            return pool
+
+    def _output_options(self, output_options: dict = None) -> dict:
+        """
+        Fills in defaults for a job's output options.
+
+        Raises:
+            ValueError: If the format is not png, jpeg or webp, or a preview
+                width is below 1.
+        """
+        options = {**DEFAULT_OUTPUT_OPTIONS, **(output_options or {})}
+        options["format"] = str(options["format"]).lower().replace("jpg", "jpeg")
+        if options["format"] not in OUTPUT_EXTENSIONS:
+            raise ValueError(f"Unsupported output format '{options['format']}', expected one of {', '.join(OUTPUT_EXTENSIONS)}.")
+        options["preview_widths"] = sorted({int(width) for width in options["preview_widths"]})
+        if options["preview_widths"] and options["preview_widths"][0] < 1:
+            raise ValueError(f"Invalid preview width {options['preview_widths'][0]}, expected at least 1.")
+        return options
+
+    def _rendition_filenames(self, page_name: str, options: dict) -> dict:
+        """Maps each rendition (None for the full page, else a preview width) to its file name."""
+        extension = OUTPUT_EXTENSIONS[options["format"]]
+        filenames = {None: f"{page_name}{extension}"}
+        for width in options["preview_widths"]:
+            filenames[width] = f"{page_name}_preview_{width}{extension}"
+        return filenames
+
+    @timed("compositor", "encode")
+    def _encode_page(self, image: Image.Image, output_path: Path, options: dict):
+        """Saves an RGB page in the job's output format."""
+        if output_path.exists():
+            # May be hard-linked into the page store; never write through it
+            output_path.unlink()
+        if options["format"] == "jpeg":
+            image.save(output_path, "JPEG", quality=options["quality"], optimize=True,
+                       progressive=options["progressive"])
+        elif options["format"] == "webp":
+            image.save(output_path, "WEBP", quality=options["quality"], lossless=options["lossless"])
+        else:
+            image.save(output_path, "PNG", compress_level=options["compress_level"])
+
+    def _render_page_safely(self, page_name: str, settings: dict, output_dir: Path, options: dict):
+        """
+        Renders (or reuses) one page, isolating failures so other pages still render.
+        Returns (output_path, preview_paths, reused), or None on error; preview_paths
+        maps each preview width narrower than the page to its path.
+        """
+        try:
+            return self._render_or_reuse_page(page_name, settings, output_dir, options)
+        except Exception as e:
+            print(f"   ❌ An unexpected error occurred on '{page_name}': {e}")
+            return None
+
+    def _page_fingerprint(self, settings: dict) -> str:
+        """
+        Hashes everything that determines a page's pixels: the page settings,
+        with template, sprite and font files replaced by their content digests.
+        """
+        return content_key({**self._content_settings(settings), "renderer_version": RENDERER_VERSION})
+
+    def _content_settings(self, settings: dict) -> dict:
+        """Returns page settings with every referenced file replaced by its content digest."""
+        template_digest = self.asset_cache.get_digest(
+            self.templates_dir / settings['template_file'], fallback_exts=IMAGE_FALLBACK_EXTS
+        )
+        layers = [
+            {**layer_data, "filename": self.asset_cache.get_digest(
+                self.sprites_dir / layer_data['filename'], fallback_exts=IMAGE_FALLBACK_EXTS
+            )}
+            for layer_data in settings.get('layers', [])
+        ]
+        text_boxes = []
+        for box in settings.get('text_boxes', []):
             try:
-                print(f"\nAssembling '{page_name}'...")
-                template_path = self.templates_dir / settings['template_file']
-                canvas = self._find_and_open_image(template_path)
-
-                for layer_data in settings.get('layers', []):
-                    # Step 1: Create the base sprite
-                    layer_type = layer_data.get('type', 'sprite')
-                    sprite_path = self.sprites_dir / layer_data['filename']
-                    if layer_type == 'circular_crop':
-                        crop_size = layer_data.get('size', 450)
-                        sprite = self._create_circular_crop(sprite_path, crop_size)
-                    else: # Default is 'sprite'
-                        sprite = self._find_and_open_image(sprite_path)
-
-                    # Step 2: Apply edge blur to the sprite itself
-                    blur_radius = layer_data.get('edge_blur', 0)
-                    if blur_radius > 0:
-                        sprite = self._apply_edge_blur(sprite, blur_radius)
-
-                    # Step 3: Apply transformations (brightness, contrast, scale, etc.)
-                    transformed_sprite = self._apply_transformations(sprite, layer_data)
-                    position = tuple(layer_data['position'])
-
-                    # --- NEW: Add Layer Drop Shadow (BEHIND the sprite) ---
-                    if layer_data.get('enable_layer_shadow', False):
-                        print(f"   - Adding drop shadow to '{layer_data['filename']}'")
-                        shadow_color = tuple(layer_data.get('layer_shadow_color', [0,0,0]))
-                        shadow_offset = layer_data.get('layer_shadow_offset', [5,5])
-                        shadow_blur = layer_data.get('layer_shadow_blur', 5)
-
-                        # Create a colored silhouette from the sprite's alpha channel
-                        alpha = transformed_sprite.getchannel('A')
-                        shadow_silhouette = Image.new('RGBA', transformed_sprite.size, shadow_color)
-                        shadow_silhouette.putalpha(alpha)
-                        
-                        # Blur the silhouette and paste it at an offset
-                        blurred_shadow = shadow_silhouette.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
-                        shadow_position = (position[0] + shadow_offset[0], position[1] + shadow_offset[1])
-                        canvas.paste(blurred_shadow, shadow_position, blurred_shadow)
-
-                    # Step 4: Add layer glow (BEHIND the sprite)
-                    if layer_data.get('enable_layer_glow', False):
-                        glow_canvas = self._create_layer_glow(canvas.size, transformed_sprite, position, layer_data)
-                        canvas = Image.alpha_composite(canvas, glow_canvas)
-
-                    # Step 5: Paste the final sprite on top of everything
-                    canvas.paste(transformed_sprite, position, transformed_sprite)
-
-                text_boxes = settings.get('text_boxes', [])
-                if text_boxes:
-                    canvas = self._draw_text_boxes(canvas, text_boxes)
-
-                output_path = self.output_dir / f"{page_name}.png"
-                canvas.convert("RGB").save(output_path)
-                print(f"   ✅ Saved: {output_path.name}")
-            except Exception as e:
-                print(f"   ❌ An unexpected error occurred on '{page_name}': {e}")
-                continue
+                font_digest = self.asset_cache.get_digest(self.fonts_dir / box.get('font', 'default.ttf'))
+            except FileNotFoundError:
+                font_digest = None  # Rendered with the default font
+            text_boxes.append({**box, "font": font_digest})
+        return {
+            **settings,
+            "template_file": template_digest,
+            "layers": layers,
+            "text_boxes": text_boxes,
+        }
+
+    def _static_prefix(self, settings: dict) -> tuple:
+        """
+        Counts the leading layers (and, if every layer is static, the leading
+        text boxes) marked `"static": true`. Only a prefix of the draw order
+        can be flattened without changing how later layers stack on top.
+        """
+        layers = settings.get('layers', [])
+        static_layers = 0
+        while static_layers < len(layers) and layers[static_layers].get('static', False):
+            static_layers += 1
+        static_boxes = 0
+        if static_layers == len(layers):
+            text_boxes = settings.get('text_boxes', [])
+            while static_boxes < len(text_boxes) and text_boxes[static_boxes].get('static', False):
+                static_boxes += 1
+        return static_layers, static_boxes
+
+    def _flattened_base(self, settings: dict, static_layers: int, static_boxes: int) -> Image.Image:
+        """
+        Returns the page's template with its static layers and text boxes
+        already drawn, built once per template/decoration version and kept
+        in memory and in the flattened template store. The result is shared;
+        copy it before drawing on it.
+        """
+        base_settings = {
+            "template_file": settings['template_file'],
+            "render_scale": settings.get('render_scale', 1.0),
+            "layers": settings.get('layers', [])[:static_layers],
+            "text_boxes": settings.get('text_boxes', [])[:static_boxes],
+        }
+        key = content_key({
+            **self._content_settings(base_settings),
+            "renderer_version": RENDERER_VERSION,
+            "stage": "flattened_base",
+        })
+
+        def build_base() -> Image.Image:
+            stored_path = self.flattened_store_dir / f"{key}.png"
+            try:
+                return read_stored_image(stored_path)
+            except FileNotFoundError:
+                pass
+            print(f"   - Pre-flattening {static_layers} static layer(s) and {static_boxes} text box(es) onto '{settings['template_file']}'")
+            base = self._load_template(settings)
+            for layer_data in base_settings['layers']:
+                self._apply_layer(base, layer_data)
+            if base_settings['text_boxes']:
+                base = self._draw_text_boxes(base, base_settings['text_boxes'])
+            self.flattened_store_dir.mkdir(parents=True, exist_ok=True)
+            write_atomically(stored_path, lambda temp_path: base.save(temp_path, "PNG", compress_level=1))
+            # A new version usually means an edited template or decoration; drop the oldest
+            if prune_directory(self.flattened_store_dir, self.flattened_store_max_bytes):
+                print("   - Pruned old flattened templates")
+            return base
+
+        return self.effect_cache.get_or_create({"flattened_base": key}, build_base)
+
+    def preflatten(self, config: dict = None) -> dict:
+        """
+        Build step: flattens the static, child-independent layers of every
+        page in the config so later per-child renders start from the cached base.
+
+        Returns:
+            Dict of page name to the number of (layers, text boxes) flattened.
+        """
+        config = self.config if config is None else config
+        flattened = {}
+        for page_name, settings in config.items():
+            static_layers, static_boxes = self._static_prefix(settings)
+            if static_layers or static_boxes:
+                self._flattened_base(settings, static_layers, static_boxes)
+                flattened[page_name] = (static_layers, static_boxes)
+        print(f"✅ Pre-flattened backgrounds for {len(flattened)} of {len(config)} pages")
+        return flattened
+
+    def _render_or_reuse_page(self, page_name: str, settings: dict, output_dir: Path, options: dict) -> tuple:
+        """
+        Links a previously rendered page with the same fingerprint and output
+        options into output_dir, or renders it and adds it to the page store.
+        Previews only exist for widths narrower than the page, so a stored page
+        is reused with whichever of its previews were stored.
+        """
+        if not self.reuse_pages:
+            return (*self._render_page(page_name, settings, output_dir, options), False)
+
+        fingerprint = content_key({"page": self._page_fingerprint(settings), "output": options})
+        stored_paths = {
+            width: self.page_store_dir / filename
+            for width, filename in self._rendition_filenames(fingerprint, options).items()
+        }
+        if stored_paths[None].exists():
+            try:
+                output_paths = {}
+                for width, filename in self._rendition_filenames(page_name, options).items():
+                    if stored_paths[width].exists():
+                        output_paths[width] = output_dir / filename
+                        self._link_file(stored_paths[width], output_paths[width])
+                        mark_used(stored_paths[width])
+                print(f"\n♻️ Reused unchanged page: {output_paths[None].name}")
+                return output_paths.pop(None), output_paths, True
+            except FileNotFoundError:
+                pass  # Pruned from the store meanwhile; render it again
+
+        output_path, preview_paths = self._render_page(page_name, settings, output_dir, options)
+        self.page_store_dir.mkdir(parents=True, exist_ok=True)
+        # Previews first, so a page in the store always has all of its previews
+        for width, rendered_path in [*preview_paths.items(), (None, output_path)]:
+            try:
+                self._link_file(rendered_path, stored_paths[width], replace=False)
+            except FileExistsError:
+                pass  # Another render of the same page got there first
+        return output_path, preview_paths, False
+
+    def _prune_page_store(self):
+        """Deletes the least recently used pages, with their previews, beyond the store's budget."""
+        deleted = prune_directory(
+            self.page_store_dir, self.page_store_max_bytes,
+            group=lambda name: Path(name).stem.split("_preview_")[0]
+        )
+        if deleted:
+            print(f"🧹 Pruned {deleted} files from the page store")
+
+    def _link_file(self, source: Path, target: Path, replace: bool = True):
+        """Hard-links source to target, copying instead when linking isn't possible."""
+        if replace and target.exists():
+            target.unlink()
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            raise
+        except OSError:
+            shutil.copyfile(source, target)
+
+    @timed("compositor", "layer_effects")
+    def _apply_layer(self, canvas: Image.Image, layer_data: dict):
+        """Draws one sprite layer, with its shadow and glow, onto the canvas in place."""
+        # Steps 1-3: base sprite, edge blur and transformations, reused from
+        # the effect cache when this pose was prepared with the same settings
+        sprite_key = self._sprite_effect_key(layer_data)
+        transformed_sprite = self.effect_cache.get_or_create(
+            sprite_key, lambda: self._build_sprite_layer(layer_data)
+        )
+        position = tuple(layer_data['position'])
+
+        # --- NEW: Add Layer Drop Shadow (BEHIND the sprite) ---
+        if layer_data.get('enable_layer_shadow', False):
+            print(f"   - Adding drop shadow to '{layer_data['filename']}'")
+            shadow_color = tuple(layer_data.get('layer_shadow_color', [0,0,0]))
+            shadow_offset = layer_data.get('layer_shadow_offset', [5,5])
+            shadow_blur = layer_data.get('layer_shadow_blur', 5)
+
+            shadow_key = {**sprite_key, "effect": "shadow", "color": list(shadow_color), "blur": shadow_blur}
+            blurred_shadow = self.effect_cache.get_or_create(
+                shadow_key, lambda: self._create_layer_shadow(transformed_sprite, shadow_color, shadow_blur)
+            )
+            shadow_position = (position[0] + shadow_offset[0], position[1] + shadow_offset[1])
+            canvas.paste(blurred_shadow, shadow_position, blurred_shadow)
+
+        # Step 4: Add layer glow (BEHIND the sprite)
+        if layer_data.get('enable_layer_glow', False):
+            glow_key = {
+                **sprite_key,
+                "effect": "glow",
+                "color": list(layer_data.get('layer_glow_color', [255, 255, 255])),
+                "radius": layer_data.get('layer_glow_radius', 15),
+            }
+            glow_layer = self.effect_cache.get_or_create(
+                glow_key, lambda: self._create_layer_glow(transformed_sprite, layer_data)
+            )
+            self._alpha_composite_at(canvas, glow_layer, position)
+
+        # Step 5: Paste the final sprite on top of everything
+        canvas.paste(transformed_sprite, position, transformed_sprite)
+
+    def _render_page(self, page_name: str, settings: dict, output_dir: Path, options: dict = None) -> tuple:
+        """
+        Composes a single page and saves it along with any preview renditions.
+        Returns (output_path, preview_paths), where preview_paths maps each
+        preview width to its path; widths at or above the page's are skipped.
+        """
+        options = self._output_options() if options is None else options
+        print(f"\nAssembling '{page_name}'...")
+
+        # Start from the pre-flattened background when the page has static layers
+        static_layers, static_boxes = self._static_prefix(settings)
+        if static_layers or static_boxes:
+            canvas = self._flattened_base(settings, static_layers, static_boxes).copy()
+        else:
+            canvas = self._load_template(settings)
+
+        for layer_data in settings.get('layers', [])[static_layers:]:
+            self._apply_layer(canvas, layer_data)
+
+        text_boxes = settings.get('text_boxes', [])[static_boxes:]
+        if text_boxes:
+            canvas = self._draw_text_boxes(canvas, text_boxes)
+
+        page = canvas.convert("RGB")
+        filenames = self._rendition_filenames(page_name, options)
+        output_path = output_dir / filenames.pop(None)
+        self._encode_page(page, output_path, options)
+        print(f"   ✅ Saved: {output_path.name}")
+
+        preview_paths = {}
+        for width, filename in filenames.items():
+            if width >= page.width:
+                continue  # The page itself is already no wider than this
+            preview = page.resize((width, max(1, round(page.height * width / page.width))), Image.LANCZOS)
+            preview_paths[width] = output_dir / filename
+            self._encode_page(preview, preview_paths[width], options)
+        return output_path, preview_paths
+
+    def run(self, config: dict = None, output_dir: str = None, page_workers: int = None,
+            output_options: dict = None, render_scale: float = 1.0) -> list:
+        """
+        Executes the main composition logic for all pages in the config.
+
+        Args:
+            config: Optional page config to render instead of the one loaded at init.
+            output_dir: Optional directory for this run's pages (e.g. one per job),
+                defaults to the shared story_final directory.
+            page_workers: Optional override for the number of pages rendered in parallel.
+            output_options: Optional encoding for this run's pages, see
+                DEFAULT_OUTPUT_OPTIONS: format ("png", "jpeg" or "webp"),
+                compress_level, quality, progressive, lossless and preview_widths.
+            render_scale: Fraction of the template resolution to render at,
+                e.g. 0.25 for quick previews; the layout scales with it.
+
+        Returns:
+            List of paths to the saved pages, in config order.
+        """
+        return self.compose(config, output_dir, page_workers, output_options, render_scale)["pages"]
+
+    def compose(self, config: dict = None, output_dir: str = None, page_workers: int = None,
+                output_options: dict = None, render_scale: float = 1.0) -> dict:
+        """
+        Same as `run`, but also reports which pages were reused unchanged.
+
+        Returns:
+            Dict with "pages" (all saved page paths, in config order),
+            "reused_pages" and "rendered_pages" (subsets of "pages") and
+            "previews" (preview width to preview paths, in page order; pages
+            no wider than a preview width have no preview at that width).
+        """
+        options = self._output_options(output_options)
+        config = self.config if config is None else config
+        if render_scale != 1.0:
+            config = {
+                page_name: self._scale_page_settings(settings, render_scale)
+                for page_name, settings in config.items()
+            }
+        output_dir = Path(output_dir) if output_dir else self.output_dir
+        output_dir.mkdir(parents=True, exist_ok=True)
+        print("\n" + "="*50 + "\n🚀 Starting Story Page Composition Process\n" + "="*50)
+        page_workers = self.page_workers if page_workers is None else page_workers
+        pages = list(config.items())
+        if page_workers > 1 and len(pages) > 1:
+            # Pages are independent; render them side by side and keep config order
+            page_pool = self._get_page_pool(page_workers)
+            futures = [
+                page_pool.submit(self._render_page_safely, page_name, settings, output_dir, options)
+                for page_name, settings in pages
+            ]
+            results = [future.result() for future in futures]
+        else:
+            results = [
+                self._render_page_safely(page_name, settings, output_dir, options)
+                for page_name, settings in pages
+            ]
+        results = [result for result in results if result is not None]
+        saved_pages = [page_path for page_path, _, _ in results]
+        reused_pages = [page_path for page_path, _, reused in results if reused]
+        if self.reuse_pages and len(reused_pages) < len(saved_pages):
+            self._prune_page_store()
+        previews = {
+            width: [preview_paths[width] for _, preview_paths, _ in results if width in preview_paths]
+            for width in options["preview_widths"]
+        }
+        cache_stats = self.asset_cache.stats()
+        print(f"📦 Asset cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+              f"{cache_stats['bytes'] / (1024 * 1024):.1f} MB cached")
+        effect_stats = self.effect_cache.stats()
+        print(f"✨ Effect cache: {effect_stats['hits']} hits, {effect_stats['misses']} misses, "
+              f"{effect_stats['disk_hits']} from disk")
+        print(f"♻️ Reused {len(reused_pages)} of {len(saved_pages)} pages")
         print("\n" + "="*50 + "\n✅ Composition process complete!\n" + "="*50)
+        return {
+            "pages": saved_pages,
+            "reused_pages": reused_pages,
+            "rendered_pages": [page_path for page_path in saved_pages if page_path not in reused_pages],
+            "previews": previews,
+        }
 
 def main():
-    config_file = "assets/composition_config.json"
-    compositor = StoryCompositor(config_path=config_file)
-    compositor.run()
+    # Usage: python compositor.py [config_path] [output_dir] [output_options_json] [render_scale]
+    #        python compositor.py --preflatten [config_path]
+    args = sys.argv[1:]
+    preflatten_only = bool(args) and args[0] == "--preflatten"
+    if preflatten_only:
+        args = args[1:]
+    config_file = args[0] if len(args) > 0 else "assets/composition_config.json"
+    output_dir = args[1] if len(args) > 1 else None
+    output_options = json.loads(args[2]) if len(args) > 2 else None
+    render_scale = float(args[3]) if len(args) > 3 else 1.0
+    compositor = StoryCompositor(config_path=config_file, base_dir="assets")
+    if preflatten_only:
+        compositor.preflatten()
+    else:
+        compositor.run(output_dir=output_dir, output_options=output_options, render_scale=render_scale)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
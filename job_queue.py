@@ -0,0 +1,154 @@
+# job_queue.py
+"""
+Bounded in-process job queue for long-running backend work.
+
+Jobs are submitted with a payload and get an ID back immediately. A fixed
+number of asyncio workers pull jobs off a bounded queue and run them through
+an async handler, so callers can poll for progress instead of holding an HTTP
+connection open for minutes.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class Job:
+    """
+    A single unit of queued work and its status.
+
+    Status moves from "queued" to "running" to either "completed" or "failed".
+    Handlers may update `progress` while running.
+    """
+    def __init__(self, payload: dict):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = "queued"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Runs submitted jobs on a fixed pool of asyncio workers.
+
+    Args:
+        handler: Async callable taking a Job and returning its result dict.
+        max_workers: Number of jobs allowed to run at the same time.
+        max_queue: Maximum number of jobs waiting to start; further submissions
+            raise QueueFullError.
+        history_limit: Maximum number of jobs kept for polling; the oldest
+            finished jobs are forgotten first.
+    """
+    def __init__(self, handler, max_workers: int = 2, max_queue: int = 20, history_limit: int = 200):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.history_limit = history_limit
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._workers = []
+
+    def start(self):
+        """Creates the queue and worker tasks. Must be called from the running event loop."""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.max_workers)
+        ]
+
+    async def stop(self):
+        """Cancels the worker tasks; queued jobs are left unfinished."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, payload: dict) -> Job:
+        """Queues a job and returns it immediately."""
+        if self._queue is None:
+            raise RuntimeError("JobQueue.start() must be called before submitting jobs.")
+        job = Job(payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Job queue is full ({self.max_queue} jobs waiting).")
+        self.jobs[job.id] = job
+        self._trim_history()
+        return job
+
+    def record_completed(self, payload: dict, result: dict) -> Job:
+        """Adds a job that finished without running (e.g. a cached result) so it can be polled like any other."""
+        job = Job(payload)
+        job.status = "completed"
+        job.result = result
+        job.started_at = job.finished_at = job.created_at
+        self.jobs[job.id] = job
+        self._trim_history()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        return self.jobs.get(job_id)
+
+    def stats(self) -> dict:
+        running = sum(1 for job in self.jobs.values() if job.status == "running")
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": running,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+        }
+
+    def _trim_history(self):
+        if len(self.jobs) <= self.history_limit:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.is_finished]:
+            if len(self.jobs) <= self.history_limit:
+                break
+            del self.jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await self.handler(job)
+                job.status = "completed"
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Job was cancelled."
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = getattr(e, "detail", None) or str(e)
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
@@ -1,18 +1,83 @@
 # backend/main.py (Enhanced with Compositor Integration)
 import os
+import re
 import json
 import shutil
 import subprocess
 import sys
+import time
+import asyncio
+import uuid
+from typing import Annotated, List, Literal, Optional
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from pydantic import BaseModel, Field
+
+from job_queue import JobQueue, QueueFullError
+from avatar_cache import AvatarResultCache
+from story_catalog import StoryCatalog, etag_for
+from metrics import span, record_stage, parse_span_line, render_metrics
+from compositor import StoryCompositor
+from PIL import Image, ImageOps
 
 app = FastAPI(title="Mitra Storybook Backend")
 
+# --- Upload Size Limit ---
+# Multipart bodies are parsed (and spooled) before an endpoint runs, so the
+# photo upload cap is enforced on the raw request body instead
+AVATAR_UPLOAD_MAX_BYTES = int(os.getenv("AVATAR_UPLOAD_MAX_MB", "20")) * 1024 * 1024
+# Room for the multipart boundaries and part headers around the photo
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    """
+    Refuses request bodies over `max_bytes` on the given paths with a 413:
+    straight away when Content-Length says so, otherwise as soon as the
+    streamed body passes the limit, before the rest of it is read. Receiving
+    the whole body is timed as the api/upload stage.
+    """
+    def __init__(self, app, max_bytes: int, paths: tuple):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Photo is larger than the {self.max_bytes // (1024 * 1024)} MB upload limit."
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_bytes + UPLOAD_FORM_OVERHEAD_BYTES:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received_bytes = 0
+        upload_start = time.perf_counter()
+
+        async def limited_receive():
+            nonlocal received_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                received_bytes += len(message.get("body", b""))
+                if received_bytes > self.max_bytes + UPLOAD_FORM_OVERHEAD_BYTES:
+                    # Re-raised by FastAPI's body parsing and turned into the response
+                    raise HTTPException(status_code=413, detail=detail)
+                if not message.get("more_body", False):
+                    record_stage("api", "upload", time.perf_counter() - upload_start)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Added before CORS so that CORS stays outermost and 413s carry its headers
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=AVATAR_UPLOAD_MAX_BYTES, paths=("/generate-avatar",))
+
 # --- CORS Middleware ---
 origins = ["http://localhost:8080", "http://127.0.0.1:8080"]
 app.add_middleware(
@@ -26,58 +91,194 @@ app.add_middleware(
 # --- Static File Serving ---
 GENERATED_ASSETS_DIR = os.path.join(os.path.dirname(__file__), 'assets', 'generated_assets')
 STORY_FINAL_DIR = os.path.join(os.path.dirname(__file__), 'assets', 'story_final')
+STORY_SPRITES_DIR = os.path.join(os.path.dirname(__file__), 'assets', 'story_sprites')
+COMPOSITION_JOBS_DIR = os.path.join(os.path.dirname(__file__), 'assets', 'composition_jobs')
+STORY_CATALOG_DIR = os.path.join(os.path.dirname(__file__), 'assets', 'story-templates')
 os.makedirs(GENERATED_ASSETS_DIR, exist_ok=True)
 os.makedirs(STORY_FINAL_DIR, exist_ok=True)
 
+# --- In-process Compositor ---
+# A single long-lived compositor shared by all requests; renders run on a
+# bounded thread pool so the event loop stays free. COMPOSE_IN_PROCESS=0
+# runs compositor.py as a subprocess per job instead.
+COMPOSE_IN_PROCESS = os.getenv("COMPOSE_IN_PROCESS", "1") != "0"
+COMPOSE_MAX_WORKERS = int(os.getenv("COMPOSE_MAX_WORKERS", "2"))
+COMPOSE_PAGE_WORKERS = int(os.getenv("COMPOSE_PAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+compose_executor = ThreadPoolExecutor(max_workers=COMPOSE_MAX_WORKERS, thread_name_prefix="compositor")
+# request_type "preview" renders at this fraction of the template resolution
+PREVIEW_SCALE = float(os.getenv("PREVIEW_SCALE", "0.25"))
+PREVIEW_OUTPUT_OPTIONS = {"format": "jpeg", "quality": 80}
+PREVIEW_MAX_WIDTH = 4096
+story_compositor = (
+    StoryCompositor(
+        base_dir=os.path.join(os.path.dirname(__file__), 'assets'),
+        page_workers=COMPOSE_PAGE_WORKERS
+    )
+    if COMPOSE_IN_PROCESS else None
+)
+
 app.mount("/generated", StaticFiles(directory=GENERATED_ASSETS_DIR), name="generated_assets")
 app.mount("/stories", StaticFiles(directory=STORY_FINAL_DIR), name="story_pages")
+if os.path.isdir(STORY_CATALOG_DIR):
+    app.mount("/story-assets", StaticFiles(directory=STORY_CATALOG_DIR), name="story_catalog_assets")
+
+# --- Story Catalog ---
+# Loaded once at startup; filters are answered from its precomputed indexes
+story_catalog = StoryCatalog(STORY_CATALOG_DIR, assets_url="/story-assets")
+
+# --- Non-blocking Helpers ---
+SCRIPT_OUTPUT_CHUNK_BYTES = 64 * 1024
+
+def script_path(path: str) -> str:
+    """Absolute form of a path printed by a script that run_script ran."""
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), path))
+
+async def run_script(command: list, on_stdout_line=None, env: dict = None) -> tuple:
+    """
+    Runs a script as an asyncio subprocess so the event loop keeps serving
+    other requests while it works. Raises CalledProcessError on failure.
+
+    Args:
+        command: Command line to execute.
+        on_stdout_line: Optional callback invoked with each stdout line as it arrives.
+        env: Optional extra environment variables for the script.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=os.path.dirname(__file__),
+        env={**os.environ, **env} if env else None
+    )
+    stderr_task = asyncio.create_task(process.stderr.read())
+    try:
+        # Read in chunks and split lines here: StreamReader's own line reading
+        # fails on lines over its 64 KiB buffer limit
+        stdout_chunks = []
+        partial_line = bytearray()
+        while chunk := await process.stdout.read(SCRIPT_OUTPUT_CHUNK_BYTES):
+            stdout_chunks.append(chunk)
+            if on_stdout_line is None:
+                continue
+            partial_line += chunk
+            lines_end = partial_line.rfind(b"\n") + 1
+            if lines_end:
+                for raw_line in bytes(partial_line[:lines_end - 1]).split(b"\n"):
+                    on_stdout_line(raw_line.decode(errors="replace") + "\n")
+                del partial_line[:lines_end]
+        if partial_line:
+            on_stdout_line(partial_line.decode(errors="replace"))
+        stderr = (await stderr_task).decode(errors="replace")
+        stdout = b"".join(stdout_chunks).decode(errors="replace")
+        await process.wait()
+    except BaseException:
+        # Cancelled (e.g. the job queue shutting down) or a callback failed:
+        # don't leave the script running
+        stderr_task.cancel()
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output=stdout, stderr=stderr)
+    return stdout, stderr
+
+def ingest_photo(source, path_stem: str) -> str:
+    """
+    Decodes an uploaded photo once and writes it as an upright RGB JPEG no
+    larger than AVATAR_PHOTO_MAX_SIDE, so every OpenAI edit sends a right-sized
+    image. Returns the written path.
+
+    Raises:
+        HTTPException: 400 if the upload is not a readable image.
+    """
+    path = f"{path_stem}.jpg"
+    try:
+        with Image.open(source) as image:
+            # Let JPEG decoding skip straight to a reduced scale when it can
+            image.draft("RGB", (AVATAR_PHOTO_MAX_SIDE, AVATAR_PHOTO_MAX_SIDE))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+                image = image.convert("RGBA")
+                flattened = Image.new("RGB", image.size, (255, 255, 255))
+                flattened.paste(image, mask=image.getchannel("A"))
+                image = flattened
+            else:
+                image = image.convert("RGB")
+            image.thumbnail((AVATAR_PHOTO_MAX_SIDE, AVATAR_PHOTO_MAX_SIDE), Image.Resampling.LANCZOS)
+            image.save(path, "JPEG", quality=AVATAR_PHOTO_QUALITY)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a readable image.") from e
+    return path
+
+def load_json(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def dump_json(data: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+def remove_if_exists(path: str):
+    if os.path.exists(path):
+        os.remove(path)
 
 # --- Request Models ---
+class PageOutputOptions(BaseModel):
+    """How composed pages are encoded: trade encode time against bytes served."""
+    format: Literal["png", "jpeg", "webp"] = "png"
+    compress_level: int = Field(6, ge=0, le=9)
+    quality: int = Field(90, ge=1, le=100)
+    progressive: bool = False
+    lossless: bool = False
+    preview_widths: List[Annotated[int, Field(ge=1, le=PREVIEW_MAX_WIDTH)]] = Field(default_factory=list, max_length=4)
+
 class StoryComposeRequest(BaseModel):
     story_id: str
     child_name: str
     selected_pose_url: str
+    # "preview" renders quickly at PREVIEW_SCALE; "personalize" is the full-resolution final order
+    request_type: Literal["preview", "personalize"] = "personalize"
+    output: Optional[PageOutputOptions] = None
 
-@app.post("/generate-avatar", tags=["Avatar"])
-async def generate_avatar_endpoint(photo: UploadFile = File(...)):
-    """Existing avatar generation endpoint - unchanged"""
-    upload_folder = 'temp_uploads'
-    os.makedirs(upload_folder, exist_ok=True)
-    temp_path = os.path.join(upload_folder, photo.filename)
-    
-    try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(photo.file, buffer)
-    finally:
-        photo.file.close()
+async def run_avatar_job(job) -> dict:
+    """Job handler: runs the avatar generator for one uploaded photo."""
+    temp_path = job.payload["photo_path"]
+
+    def track_progress(line: str):
+        # Span lines from pool workers can land on the same line as progress output
+        parse_span_line(line)
+        # The generator announces each task as "Task <n>/<total>"
+        matches = TASK_PROGRESS_PATTERN.findall(line)
+        if matches:
+            current, total = (int(value) for value in matches[-1])
+            job.progress = {"completed_tasks": current - 1, "total_tasks": total}
+
+    cache_key = job.payload.get("cache_key")
 
     try:
         # Run avatar generator
         command = [
             sys.executable,
             "avatar_generator.py",
-            temp_path,
+            os.path.abspath(temp_path),
             "avatar_generator.json"
         ]
         
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=True,
-            cwd=os.path.dirname(__file__)
-        )
+        # SPAN_LOG makes the generator print its stage timings for /metrics
+        stdout, stderr = await run_script(command, on_stdout_line=track_progress, env={"SPAN_LOG": "1"})
         
         # Parse output directory
-        output_dir_line = next((line for line in result.stdout.splitlines() if 'All assets saved in:' in line), None)
+        output_dir_line = next((line for line in stdout.splitlines() if 'All assets saved in:' in line), None)
         if not output_dir_line:
             raise HTTPException(status_code=500, detail={
                 "error": "Could not determine output directory from script.",
-                "stdout": result.stdout,
-                "stderr": result.stderr
+                "stdout": stdout,
+                "stderr": stderr
             })
         
-        output_dir = output_dir_line.split('All assets saved in: ')[1].strip()
+        # The generator prints paths relative to its own working directory
+        output_dir = script_path(output_dir_line.split('All assets saved in: ')[1].strip())
 
         # Read generation report
         report_path = os.path.join(output_dir, "generation_report.json")
@@ -87,26 +288,31 @@ async def generate_avatar_endpoint(photo: UploadFile = File(...)):
                 "output_dir": output_dir
             })
 
-        with open(report_path, 'r') as f:
-            report_data = json.load(f)
+        report_data = await run_in_threadpool(load_json, report_path)
 
-        relative_pose_paths = report_data.get("poses", [])
-        if not relative_pose_paths:
+        pose_paths = [script_path(path) for path in report_data.get("poses", [])]
+        if not pose_paths:
             raise HTTPException(status_code=500, detail={
                 "error": "No poses found in generation report."
             })
 
         # Convert paths to URLs
         pose_urls = []
-        for path in relative_pose_paths:
-            url_path = os.path.relpath(path, GENERATED_ASSETS_DIR)
+        for path in pose_paths:
+            url_path = os.path.relpath(path, os.path.abspath(GENERATED_ASSETS_DIR))
             pose_urls.append(f"/generated/{url_path.replace(os.sep, '/')}")
 
-        return JSONResponse(content={
+        if job.progress:
+            job.progress["completed_tasks"] = job.progress["total_tasks"]
+
+        result = {
             "message": "Avatar poses generated successfully!",
             "pose_urls": pose_urls,
             "session_id": Path(output_dir).name  # Return session ID for later use
-        })
+        }
+        if cache_key is not None:
+            await run_in_threadpool(avatar_cache.put, cache_key, result, output_dir, pose_paths)
+        return result
 
     except subprocess.CalledProcessError as e:
         raise HTTPException(status_code=500, detail={
@@ -114,8 +320,181 @@ async def generate_avatar_endpoint(photo: UploadFile = File(...)):
             "details": e.stderr
         })
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        await run_in_threadpool(remove_if_exists, temp_path)
+
+# --- Avatar Job Queue ---
+# Avatar generation takes minutes, so requests are queued and polled via
+# GET /jobs/{job_id}. Concurrency and queue depth are bounded by env vars.
+AVATAR_MAX_CONCURRENCY = int(os.getenv("AVATAR_MAX_CONCURRENCY", "2"))
+AVATAR_QUEUE_MAX = int(os.getenv("AVATAR_QUEUE_MAX", "20"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "200"))
+TASK_PROGRESS_PATTERN = re.compile(r"Task (\d+)/(\d+)")
+# Uploads are capped by UploadSizeLimitMiddleware and normalized once at ingest
+AVATAR_PHOTO_MAX_SIDE = int(os.getenv("AVATAR_PHOTO_MAX_SIDE", "1536"))
+AVATAR_PHOTO_QUALITY = int(os.getenv("AVATAR_PHOTO_QUALITY", "90"))
+# Finished generations keyed by normalized photo + prompt config; TTL 0 disables
+AVATAR_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "avatar_generator.json")
+avatar_cache = AvatarResultCache(
+    index_path=os.path.join(os.path.dirname(__file__), 'assets', 'avatar_cache.json'),
+    ttl_seconds=float(os.getenv("AVATAR_CACHE_TTL_HOURS", "168")) * 3600,
+    max_bytes=int(os.getenv("AVATAR_CACHE_MAX_MB", "2048")) * 1024 * 1024
+)
+
+avatar_jobs = JobQueue(
+    run_avatar_job,
+    max_workers=AVATAR_MAX_CONCURRENCY,
+    max_queue=AVATAR_QUEUE_MAX,
+    history_limit=JOB_HISTORY_LIMIT
+)
+
+@app.on_event("startup")
+async def start_job_workers():
+    avatar_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await avatar_jobs.stop()
+
+@app.on_event("startup")
+async def load_story_catalog():
+    await run_in_threadpool(story_catalog.load)
+
+# --- Story Output Retention ---
+# Every composition writes to its own story_final/<job_id>/ directory; these
+# are deleted once unchanged for the TTL (0 keeps them forever)
+STORY_OUTPUT_TTL_HOURS = float(os.getenv("STORY_OUTPUT_TTL_HOURS", "72"))
+STORY_OUTPUT_SWEEP_SECONDS = 3600
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+story_output_sweeper = None
+
+def sweep_story_outputs(max_age_seconds: float) -> int:
+    """Deletes job output directories not modified for `max_age_seconds`. Returns how many."""
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for entry in os.scandir(STORY_FINAL_DIR):
+        try:
+            if entry.is_dir() and JOB_ID_PATTERN.fullmatch(entry.name) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+async def sweep_story_outputs_periodically():
+    while True:
+        removed = await run_in_threadpool(sweep_story_outputs, STORY_OUTPUT_TTL_HOURS * 3600)
+        if removed:
+            print(f"🧹 Removed {removed} expired story output directories")
+        await asyncio.sleep(STORY_OUTPUT_SWEEP_SECONDS)
+
+@app.on_event("startup")
+async def start_story_output_sweeper():
+    global story_output_sweeper
+    if STORY_OUTPUT_TTL_HOURS > 0:
+        story_output_sweeper = asyncio.create_task(sweep_story_outputs_periodically())
+
+@app.on_event("shutdown")
+async def stop_story_output_sweeper():
+    if story_output_sweeper is not None:
+        story_output_sweeper.cancel()
+
+def etag_response(request: Request, payload, etag: str) -> Response:
+    """JSON response with an ETag; 304 with no body if the client already has this version."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    client_etags = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in client_etags or "*" in client_etags:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=payload, headers=headers)
+
+def split_terms(params: Optional[List[str]]) -> list:
+    """Accepts both repeated (?values=a&values=b) and comma-joined (?values=a,b) query params."""
+    return [term.strip() for param in params or [] for term in param.split(",") if term.strip()]
+
+@app.get("/api/stories/metadata", tags=["Story"])
+async def get_story_metadata(request: Request):
+    """Metadata for every story in the catalog"""
+    return etag_response(request, story_catalog.metadata, story_catalog.metadata_etag)
+
+@app.get("/api/stories", tags=["Story"])
+async def get_stories(
+    request: Request,
+    ageGroup: Optional[str] = None,
+    values: Optional[List[str]] = Query(None),
+    occasions: Optional[List[str]] = Query(None),
+    recipients: Optional[List[str]] = Query(None)
+):
+    """Story metadata filtered like the Stories page: age group, then any-of per facet"""
+    try:
+        stories = story_catalog.filter(
+            age_group=ageGroup,
+            values=split_terms(values),
+            occasions=split_terms(occasions),
+            recipients=split_terms(recipients)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return etag_response(request, stories, etag_for(stories))
+
+@app.get("/api/stories/{story_id}", tags=["Story"])
+async def get_story(request: Request, story_id: str):
+    """Full details of one story"""
+    story = story_catalog.get(story_id)
+    if story is None:
+        raise HTTPException(status_code=404, detail=f"Story not found: {story_id}")
+    return etag_response(request, story, story_catalog.detail_etag(story_id))
+
+@app.post("/generate-avatar", tags=["Avatar"], status_code=202)
+async def generate_avatar_endpoint(photo: UploadFile = File(...)):
+    """Queue avatar generation for an uploaded photo and return a job ID to poll"""
+    upload_folder = 'temp_uploads'
+    os.makedirs(upload_folder, exist_ok=True)
+    # A unique name per upload, so concurrent uploads with the same filename don't collide
+    path_stem = os.path.join(upload_folder, uuid.uuid4().hex)
+    
+    try:
+        with span("api", "ingest"):
+            temp_path = await run_in_threadpool(ingest_photo, photo.file, path_stem)
+    finally:
+        await photo.close()
+
+    cache_key = None
+    if avatar_cache.enabled:
+        cache_key = await run_in_threadpool(avatar_cache.key, temp_path, AVATAR_CONFIG_PATH)
+        cached_result = await run_in_threadpool(avatar_cache.get, cache_key)
+        if cached_result is not None:
+            # Same photo and prompts as an earlier generation: no need to run it again
+            await run_in_threadpool(remove_if_exists, temp_path)
+            job = avatar_jobs.record_completed({"cache_key": cache_key}, cached_result)
+            return JSONResponse(status_code=200, content={
+                "message": "Avatar poses found in cache.",
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": f"/jobs/{job.id}",
+                "cached": True,
+                "result": cached_result
+            })
+
+    try:
+        job = avatar_jobs.submit({"photo_path": temp_path, "cache_key": cache_key})
+    except QueueFullError as e:
+        await run_in_threadpool(remove_if_exists, temp_path)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    return JSONResponse(status_code=202, content={
+        "message": "Avatar generation queued.",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "cached": False
+    })
+
+@app.get("/jobs/{job_id}", tags=["Avatar"])
+async def get_job_status(job_id: str):
+    """Poll the status, progress and result of a queued avatar generation job"""
+    job = avatar_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
 
 @app.post("/compose-story", tags=["Story"])
 async def compose_story_endpoint(request: StoryComposeRequest):
@@ -133,48 +512,68 @@ async def compose_story_endpoint(request: StoryComposeRequest):
         if not os.path.exists(selected_pose_path):
             raise HTTPException(status_code=404, detail=f"Selected pose not found: {selected_pose_path}")
         
-        # Create story-specific sprite directory
-        sprite_dir = os.path.join(os.path.dirname(__file__), 'assets', 'story_sprites')
-        os.makedirs(sprite_dir, exist_ok=True)
-        
-        # Copy selected pose to sprite directory with story-specific name
-        story_sprite_path = os.path.join(sprite_dir, f"{request.story_id}_{request.child_name}_main.png")
-        shutil.copy2(selected_pose_path, story_sprite_path)
-        
-        # Generate composition config based on story
-        composition_config = generate_story_config(request.story_id, request.child_name)
-        config_path = os.path.join(os.path.dirname(__file__), 'assets', 'composition_config.json')
-        
-        with open(config_path, 'w') as f:
-            json.dump(composition_config, f, indent=2)
-        
-        # Run compositor
-        command = [sys.executable, "compositor.py"]
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=True,
-            cwd=os.path.dirname(__file__)
-        )
-        
-        # Check for generated story pages
-        story_pages = []
-        if os.path.exists(STORY_FINAL_DIR):
-            for page_file in sorted(os.listdir(STORY_FINAL_DIR)):
-                if page_file.endswith('.png'):
-                    story_pages.append(f"/stories/{page_file}")
+        # Every composition gets its own job ID, sprite directory and output
+        # directory so concurrent requests never see each other's files
+        job_id = uuid.uuid4().hex
+        sprite_dir = os.path.join(STORY_SPRITES_DIR, job_id)
+        output_dir = os.path.join(STORY_FINAL_DIR, job_id)
+
+        is_preview = request.request_type == "preview"
+        if request.output is not None:
+            output_options = request.output.model_dump()
+        else:
+            output_options = PREVIEW_OUTPUT_OPTIONS if is_preview else None
+        render_scale = PREVIEW_SCALE if is_preview else 1.0
+        try:
+            os.makedirs(sprite_dir, exist_ok=True)
+
+            # Copy selected pose to the job's sprite directory with story-specific name
+            sprite_filename = f"{request.story_id}_{request.child_name}_main.png"
+            await run_in_threadpool(shutil.copy2, selected_pose_path, os.path.join(sprite_dir, sprite_filename))
+
+            # Generate composition config based on story
+            composition_config = generate_story_config(
+                request.story_id, request.child_name, sprite_filename=f"{job_id}/{sprite_filename}"
+            )
+
+            if story_compositor is not None:
+                loop = asyncio.get_running_loop()
+                composition = await loop.run_in_executor(
+                    compose_executor, story_compositor.compose, composition_config, output_dir,
+                    None, output_options, render_scale
+                )
+            else:
+                # COMPOSE_IN_PROCESS=0: the subprocess can't report which pages were reused
+                composition = await run_compositor_subprocess(
+                    job_id, composition_config, output_dir, output_options, render_scale
+                )
+        finally:
+            # The pages are written; the job's copy of the pose isn't needed any more
+            await run_in_threadpool(shutil.rmtree, sprite_dir, True)
+
+        story_pages = [f"/stories/{job_id}/{Path(page_path).name}" for page_path in composition["pages"]]
+        reused_pages = [f"/stories/{job_id}/{Path(page_path).name}" for page_path in composition["reused_pages"]]
+        preview_pages = {
+            str(width): [f"/stories/{job_id}/{Path(preview_path).name}" for preview_path in preview_paths]
+            for width, preview_paths in composition["previews"].items()
+        }
         
         if not story_pages:
             raise HTTPException(status_code=500, detail="No story pages were generated")
         
         return JSONResponse(content={
             "message": "Story composed successfully!",
+            "job_id": job_id,
             "story_pages": story_pages,
+            "reused_pages": reused_pages,
+            "preview_pages": preview_pages,
+            "request_type": request.request_type,
             "child_name": request.child_name,
             "story_id": request.story_id
         })
         
+    except HTTPException:
+        raise
     except subprocess.CalledProcessError as e:
         raise HTTPException(status_code=500, detail={
             "error": "Story composition failed",
@@ -185,8 +584,43 @@ async def compose_story_endpoint(request: StoryComposeRequest):
             "error": f"Unexpected error: {str(e)}"
         })
 
-def generate_story_config(story_id: str, child_name: str) -> dict:
+async def run_compositor_subprocess(job_id: str, composition_config: dict, output_dir: str,
+                                   output_options: dict = None, render_scale: float = 1.0) -> dict:
+    """COMPOSE_IN_PROCESS=0: write the job's config to disk and run compositor.py in a fresh interpreter."""
+    os.makedirs(COMPOSITION_JOBS_DIR, exist_ok=True)
+    config_path = os.path.join(COMPOSITION_JOBS_DIR, f"{job_id}.json")
+    await run_in_threadpool(dump_json, composition_config, config_path)
+
+    command = [sys.executable, "compositor.py", config_path, output_dir]
+    if output_options or render_scale != 1.0:
+        command.append(json.dumps(output_options or {}))
+    if render_scale != 1.0:
+        command.append(str(render_scale))
+    try:
+        await run_script(command, on_stdout_line=parse_span_line, env={"SPAN_LOG": "1"})
+    finally:
+        await run_in_threadpool(remove_if_exists, config_path)
+
+    # Only report the pages this config asked for, in whatever format they were written
+    extension = {"jpeg": ".jpg", "webp": ".webp"}.get((output_options or {}).get("format"), ".png")
+    preview_widths = (output_options or {}).get("preview_widths") or []
+    story_pages = []
+    previews = {width: [] for width in sorted(set(preview_widths))}
+    for page_name in composition_config:
+        page_path = os.path.join(output_dir, f"{page_name}{extension}")
+        if os.path.exists(page_path):
+            story_pages.append(page_path)
+            for width in previews:
+                # Pages no wider than a preview width get no preview at that width
+                preview_path = os.path.join(output_dir, f"{page_name}_preview_{width}{extension}")
+                if os.path.exists(preview_path):
+                    previews[width].append(preview_path)
+    return {"pages": story_pages, "reused_pages": [], "previews": previews}
+
+def generate_story_config(story_id: str, child_name: str, sprite_filename: str = None) -> dict:
     """Generate composition configuration for a specific story"""
+    if sprite_filename is None:
+        sprite_filename = f"{story_id}_{child_name}_main.png"
     
     # Basic template - you'll expand this based on your stories
     config = {
@@ -194,7 +628,7 @@ def generate_story_config(story_id: str, child_name: str) -> dict:
             "template_file": f"{story_id}/page1_background.png",
             "layers": [
                 {
-                    "filename": f"{story_id}_{child_name}_main.png",
+                    "filename": sprite_filename,
                     "type": "sprite",
                     "position": [400, 300],
                     "scale": 1.0,
@@ -224,10 +658,23 @@ def generate_story_config(story_id: str, child_name: str) -> dict:
     
     return config
 
+@app.get("/metrics", tags=["System"], response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Per-stage timing histograms in the Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health", tags=["System"])
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "Mitra Storybook Backend"}
+    return {
+        "status": "healthy",
+        "service": "Mitra Storybook Backend",
+        "avatar_jobs": avatar_jobs.stats(),
+        "avatar_cache": avatar_cache.stats(),
+        "asset_cache": story_compositor.asset_cache.stats() if story_compositor is not None else None,
+        "effect_cache": story_compositor.effect_cache.stats() if story_compositor is not None else None,
+        "text_cache": story_compositor.text_cache.stats() if story_compositor is not None else None
+    }
 
 if __name__ == "__main__":
     import uvicorn
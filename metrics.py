@@ -0,0 +1,119 @@
+# metrics.py
+"""
+Per-stage timing spans and Prometheus-format histograms.
+
+Code wraps each stage of its work in `span(component, stage)`. Durations
+are recorded into a process-wide histogram that the API serves on
+/metrics. Scripts running in a subprocess (the avatar generator and its
+process pool) can't reach the API's histograms directly; when SPAN_LOG=1
+they also write each span to stdout, which `parse_span_line` turns back
+into an observation on the API side. Pool workers share that pipe with
+their parent, so a span may end up on the same line as other output.
+"""
+
+import os
+import re
+import sys
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) for stage histograms: sub-millisecond text layout
+# up to multi-minute OpenAI calls
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+SPAN_LINE_PATTERN = re.compile(r"SPAN component=(\S+) stage=(\S+) seconds=([0-9.]+)")
+
+
+class Histogram:
+    """
+    Thread-safe cumulative histogram with labels, rendered in the
+    Prometheus text exposition format.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: tuple, buckets: tuple = STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_items:
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_duration = Histogram(
+    "mitra_stage_duration_seconds",
+    "Time spent in each processing stage.",
+    ("component", "stage"),
+)
+
+
+def record_stage(component: str, stage: str, seconds: float):
+    """Adds one stage duration to the histogram (and prints it when SPAN_LOG=1)."""
+    stage_duration.observe(seconds, component=component, stage=stage)
+    if os.getenv("SPAN_LOG") == "1":
+        # One unbuffered write per span, so it can't be split by another process's output
+        sys.stdout.flush()
+        os.write(sys.stdout.fileno(), f"SPAN component={component} stage={stage} seconds={seconds:.6f}\n".encode())
+
+
+@contextmanager
+def span(component: str, stage: str):
+    """Times the enclosed block as one `stage` of `component`, even if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(component, stage, time.perf_counter() - start)
+
+
+def timed(component: str, stage: str):
+    """Decorator form of `span` for functions and methods that are one whole stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(component, stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_span_line(line: str) -> int:
+    """Records every span a SPAN_LOG subprocess wrote into `line`. Returns how many there were."""
+    spans = 0
+    for match in SPAN_LINE_PATTERN.finditer(line):
+        stage_duration.observe(float(match.group(3)), component=match.group(1), stage=match.group(2))
+        spans += 1
+    return spans
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return stage_duration.render()
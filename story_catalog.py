@@ -0,0 +1,185 @@
+# story_catalog.py
+"""
+In-memory story catalog with precomputed filter indexes.
+
+Every directory under the story templates folder is one story. Its metadata
+comes from an optional `story.json` in that directory (title, ageRange,
+values, occasions, recipients, description, theme, pages, ...); anything
+missing falls back to defaults derived from the directory and its images.
+
+The catalog is loaded once and answers the frontend's filters from inverted
+indexes: term -> story IDs for values, occasions and recipients, and
+stories sorted by minimum and maximum age for age groups. Every response
+body gets a stable ETag so clients can revalidate cheaply.
+"""
+
+import json
+import bisect
+import hashlib
+from pathlib import Path
+
+STORY_METADATA_FILE = "story.json"
+PAGE_IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp")
+FACETS = ("values", "occasions", "recipients")
+PAGE_COLORS = ("#FDE68A", "#BFDBFE", "#FBCFE8", "#BBF7D0", "#DDD6FE", "#FED7AA")
+
+
+def etag_for(payload) -> str:
+    """Strong ETag for a JSON-serializable response body."""
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+class StoryCatalog:
+    """
+    Story metadata and details, loaded from disk once.
+
+    Args:
+        stories_dir: Folder with one subdirectory per story.
+        assets_url: URL prefix the story directories are served under, used
+            for page and cover image URLs.
+    """
+    def __init__(self, stories_dir: str, assets_url: str = "/story-assets"):
+        self.stories_dir = Path(stories_dir)
+        self.assets_url = assets_url.rstrip("/")
+        self._clear()
+
+    def _clear(self):
+        self.metadata = []  # StoryMetadata dicts in catalog order
+        self.details = {}  # story ID -> StoryData dict
+        self._positions = {}  # story ID -> index in self.metadata
+        self._facet_index = {facet: {} for facet in FACETS}  # facet -> term -> set of IDs
+        self._always_show = set()
+        self._min_ages, self._ids_by_min_age = [], []  # sorted by minimum age
+        self._max_ages, self._ids_by_max_age = [], []  # sorted by maximum age
+        self.metadata_etag = etag_for([])
+        self._detail_etags = {}
+
+    def load(self):
+        """(Re)reads every story directory and rebuilds the indexes."""
+        self._clear()
+        stories = []
+        if self.stories_dir.is_dir():
+            for story_dir in sorted(path for path in self.stories_dir.iterdir() if path.is_dir()):
+                try:
+                    stories.append(self._read_story(story_dir))
+                except (OSError, ValueError) as e:
+                    print(f"⚠️ Skipping story '{story_dir.name}': {e}")
+
+        # Stories without an explicit order keep directory order; always-show cards go last
+        stories.sort(key=lambda story: (story[0].get("alwaysShow", False), story[2]))
+        for metadata, details, _ in stories:
+            self._add(metadata, details)
+        self.metadata_etag = etag_for(self.metadata)
+        print(f"📚 Story catalog loaded: {len(self.metadata)} stories")
+
+    def get(self, story_id: str) -> dict:
+        return self.details.get(story_id)
+
+    def detail_etag(self, story_id: str) -> str:
+        return self._detail_etags.get(story_id)
+
+    def filter(self, age_group: str = None, values: list = None, occasions: list = None,
+               recipients: list = None) -> list:
+        """
+        Returns the StoryMetadata matching the frontend's filter rules: a story
+        must lie fully inside the "min-max" age group, and match at least one
+        requested term in each facet that has any. Always-show stories are
+        always included.
+
+        Raises:
+            ValueError: If age_group is not "all" or "<min>-<max>".
+        """
+        matches = None
+        if age_group and age_group != "all":
+            matches = self._age_matches(age_group)
+        for facet, terms in zip(FACETS, (values, occasions, recipients)):
+            if not terms:
+                continue
+            facet_matches = set()
+            for term in terms:
+                facet_matches |= self._facet_index[facet].get(term, set())
+            matches = facet_matches if matches is None else matches & facet_matches
+        if matches is None:
+            return list(self.metadata)
+        matches = matches | self._always_show
+        return [self.metadata[position] for position in sorted(self._positions[story_id] for story_id in matches)]
+
+    def _age_matches(self, age_group: str) -> set:
+        try:
+            min_age, max_age = (float(part) for part in age_group.split("-"))
+        except ValueError:
+            raise ValueError(f"Invalid age group '{age_group}', expected 'all' or '<min>-<max>'.")
+        starts_inside = self._ids_by_min_age[bisect.bisect_left(self._min_ages, min_age):]
+        ends_inside = self._ids_by_max_age[:bisect.bisect_right(self._max_ages, max_age)]
+        return set(starts_inside).intersection(ends_inside)
+
+    def _add(self, metadata: dict, details: dict):
+        story_id = metadata["id"]
+        self._positions[story_id] = len(self.metadata)
+        self.metadata.append(metadata)
+        self.details[story_id] = details
+        self._detail_etags[story_id] = etag_for(details)
+        if metadata.get("alwaysShow"):
+            self._always_show.add(story_id)
+        for facet in FACETS:
+            for term in metadata[facet]:
+                self._facet_index[facet].setdefault(term, set()).add(story_id)
+        for ages, ids, age in ((self._min_ages, self._ids_by_min_age, metadata["ageRange"]["min"]),
+                               (self._max_ages, self._ids_by_max_age, metadata["ageRange"]["max"])):
+            position = bisect.bisect_right(ages, age)
+            ages.insert(position, age)
+            ids.insert(position, story_id)
+
+    def _read_story(self, story_dir: Path) -> tuple:
+        """Builds (StoryMetadata, StoryData, sort order) for one story directory."""
+        story_id = story_dir.name
+        config = {}
+        config_path = story_dir / STORY_METADATA_FILE
+        if config_path.exists():
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+
+        title = config.get("title") or story_id.replace("-", " ").replace("_", " ").title()
+        age_range = config.get("ageRange", {})
+        age_range = {"min": age_range.get("min", 0), "max": age_range.get("max", 100)}
+        images = sorted(path.name for path in story_dir.iterdir() if path.suffix.lower() in PAGE_IMAGE_EXTS)
+        image_url = config.get("imageUrl") or (f"{self.assets_url}/{story_id}/{images[0]}" if images else None)
+
+        metadata = {
+            "id": story_id,
+            "title": title,
+            "ageRange": age_range,
+            **{facet: list(config.get(facet, [])) for facet in FACETS},
+        }
+        for optional in ("alwaysShow", "description", "theme"):
+            if optional in config:
+                metadata[optional] = config[optional]
+        if image_url:
+            metadata["imageUrl"] = image_url
+
+        pages = config.get("pages")
+        if pages is None:
+            pages = [
+                {"title": Path(image).stem.replace("_", " ").title(), "imageUrl": f"{self.assets_url}/{story_id}/{image}"}
+                for image in images
+            ]
+        pages = [
+            {"id": i + 1, "color": PAGE_COLORS[i % len(PAGE_COLORS)], "title": f"Page {i + 1}", **page}
+            for i, page in enumerate(pages)
+        ]
+
+        details = {
+            "id": story_id,
+            "title": title,
+            "subtitle": config.get("subtitle", ""),
+            "description": config.get("description", ""),
+            "ageRange": f"{age_range['min']}-{age_range['max']} years",
+            "pageCount": config.get("pageCount", len(pages)),
+            "theme": config.get("theme", ""),
+            "pages": pages,
+            "metadata": {facet: metadata[facet] for facet in FACETS},
+        }
+        if image_url:
+            details["imageUrl"] = image_url
+        return metadata, details, config.get("order", float("inf"))
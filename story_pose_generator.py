@@ -13,11 +13,17 @@ Features:
 - Crops excess alpha to create "die-cut sticker" style sprites
 - Outputs clean, individual sprites ready for story composition
 - Generates image_dimensions.json with all sprite dimensions
+- Runs OpenAI tasks concurrently with a max-in-flight limit and rate limiter
+- Processes sprites on a process pool so API waits and CPU work overlap
 """
 
 import os
+import io
 import json
 import time
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 import openai
@@ -28,99 +34,83 @@ import numpy as np
 import cv2
 import requests
 import sys
+from metrics import span, timed
 
-class StoryPoseGenerator:
+class TokenBucket:
     """
-    Generates and processes avatar poses for story composition.
+    Thread-safe token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`;
+    `acquire` blocks until a token is available.
     """
-    def __init__(self, config_path: str = "story_pose_prompts.json"):
-        """
-        Initializes the generator and loads configuration.
-        
-        Args:
-            config_path (str): Path to the JSON file containing prompts and parameters.
-        """
-        load_dotenv()
-        
-        # Initialize OpenAI client
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        if not os.getenv("OPENAI_API_KEY"):
-            sys.exit("❌ Error: OPENAI_API_KEY not found in .env file.")
-        
-        self.config = self._load_config(config_path)
-        
-        # Create output directory for processed sprites
-        self.output_dir = Path("assets/story_sprites") / datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.output_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Track generated poses for summary
-        self.generated_poses = []
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
 
-    def _load_config(self, config_path: str) -> dict:
-        """Loads configuration from the specified JSON file."""
-        config_path_obj = Path(config_path)
-        if not config_path_obj.exists():
-            sys.exit(f"❌ Error: Config file not found at '{config_path}'.")
-        try:
-            with open(config_path_obj, 'r', encoding='utf-8') as f:
-                print(f"✅ Successfully loaded config from {config_path_obj.name}")
-                return json.load(f)
-        except json.JSONDecodeError:
-            sys.exit(f"❌ Error: Could not decode JSON from '{config_path}'.")
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
 
-    def _save_openai_image(self, response, path: Path):
-        """Helper to save image from OpenAI API response."""
-        try:
-            if response.data[0].b64_json:
-                img_bytes = base64.b64decode(response.data[0].b64_json)
-            elif response.data[0].url:
-                img_data = requests.get(response.data[0].url, timeout=30).content
-                img_bytes = img_data
-            else:
-                raise Exception("No valid image data in OpenAI response")
-            with open(path, 'wb') as f:
-                f.write(img_bytes)
-        except Exception as e:
-            raise Exception(f"Failed to save OpenAI image: {e}")
+
+class SpriteProcessor:
+    """
+    CPU-side sprite processing: background removal, splitting and cropping.
+
+    Holds no API clients, so it can be created cheaply inside worker processes.
+    """
+    # Working precision for edge decontamination; float16 halves the memory
+    # of the gathered edge pixels at the cost of rounding a few values by one
+    edge_dtype = np.float32
+
+    def __init__(self, edge_dtype=None):
+        if edge_dtype is not None:
+            self.edge_dtype = edge_dtype
 
     def decontaminate_edges(self, rgb_array, alpha_channel):
         """
         Remove white color bleeding from semi-transparent edges.
         This restores the original colors that got mixed with white background.
         
+        Only the edge pixels are gathered and un-blended (all three channels in
+        one step), then written back into rgb_array in place.
+        
         Args:
-            rgb_array: RGB channels as float32 array
+            rgb_array: RGB channels as uint8 or float array, modified in place
             alpha_channel: Alpha channel as float32 array (0-1 range)
         
         Returns:
-            Decontaminated RGB array
+            Decontaminated RGB array (the same array that was passed in)
         """
         # Find semi-transparent pixels (these are the edge pixels)
         semi_transparent_mask = (alpha_channel > 0.1) & (alpha_channel < 0.95)
         
         if np.any(semi_transparent_mask):
-            # For each color channel, restore the original color
+            # Restore the original color of every edge pixel at once
             # Formula: original = (observed - white * (1 - alpha)) / alpha
             # This reverses the blend: observed = original * alpha + white * (1 - alpha)
+            edge_pixels = rgb_array[semi_transparent_mask].astype(self.edge_dtype)
+            edge_alpha = alpha_channel[semi_transparent_mask].astype(self.edge_dtype)[:, None]
             
-            for c in range(3):
-                channel = rgb_array[:, :, c].copy()
-                
-                # Remove white contamination from semi-transparent pixels
-                original_color = np.where(
-                    semi_transparent_mask,
-                    np.clip(
-                        (channel - 255 * (1 - alpha_channel)) / np.maximum(alpha_channel, 0.01),
-                        0, 
-                        255
-                    ),
-                    channel
-                )
-                rgb_array[:, :, c] = original_color
+            edge_pixels -= 255 * (1 - edge_alpha)
+            edge_pixels /= np.maximum(edge_alpha, 0.01)
+            np.clip(edge_pixels, 0, 255, out=edge_pixels)
+            
+            rgb_array[semi_transparent_mask] = edge_pixels.astype(rgb_array.dtype)
         
         return rgb_array
 
+    @timed("pose_generator", "matte")
     def remove_white_background(self, image_array):
         """
         Advanced white background removal with edge decontamination.
@@ -180,18 +170,20 @@ class StoryPoseGenerator:
         
         if np.any(expansion_zone):
             # For pixels in expansion zone, create gradient based on brightness
-            zone_coords = np.where(expansion_zone)
-            for y, x in zip(zone_coords[0], zone_coords[1]):
-                pixel_gray = gray[y, x]
-                
-                if pixel_gray > 230:  # Light pixels (likely background remnants)
-                    # Map 230-255 to alpha 255-0 (lighter = more transparent)
-                    alpha_val = max(0, 255 - ((pixel_gray - 230) / 25 * 255))
-                    alpha_channel[y, x] = alpha_val / 255.0
-                elif pixel_gray > 200:  # Medium-light pixels
-                    # Partial transparency for transition
-                    alpha_val = min(255, (230 - pixel_gray) / 30 * 128 + 127)
-                    alpha_channel[y, x] = alpha_val / 255.0
+            # (computed for the whole zone at once; darker pixels stay opaque)
+            zone_gray = gray[expansion_zone].astype(np.float64)
+            zone_alpha = alpha_channel[expansion_zone]
+            
+            # Light pixels (likely background remnants):
+            # map 230-255 to alpha 255-0 (lighter = more transparent)
+            light = zone_gray > 230
+            zone_alpha[light] = np.maximum(0, 255 - ((zone_gray[light] - 230) / 25 * 255)) / 255.0
+            
+            # Medium-light pixels: partial transparency for transition
+            medium = (zone_gray > 200) & ~light
+            zone_alpha[medium] = np.minimum(255, (230 - zone_gray[medium]) / 30 * 128 + 127) / 255.0
+            
+            alpha_channel[expansion_zone] = zone_alpha
         
         # Step 5: Apply Gaussian blur for smooth transitions
         # Smaller kernel for less blurring, preserving hair details
@@ -199,8 +191,8 @@ class StoryPoseGenerator:
         
         # Step 6: Color decontamination
         # This is crucial for hair quality - removes white mixing from edges
-        rgb_float = rgb.astype(np.float32)
-        rgb_decontaminated = self.decontaminate_edges(rgb_float, alpha_channel)
+        # (edge pixels are fixed in place, so no full-frame float copy is needed)
+        rgb_decontaminated = self.decontaminate_edges(rgb, alpha_channel)
         
         # Step 7: Refine alpha channel to ensure no harsh edges
         # Apply slight morphological operations to clean up
@@ -216,28 +208,30 @@ class StoryPoseGenerator:
         # Step 8: Combine into final RGBA image
         if image_array.shape[2] == 3:
             image_array = np.dstack([
-                rgb_decontaminated.astype(np.uint8),
+                rgb_decontaminated,
                 alpha_uint8
             ])
         else:
-            image_array[:, :, :3] = rgb_decontaminated.astype(np.uint8)
+            image_array[:, :, :3] = rgb_decontaminated
             image_array[:, :, 3] = alpha_uint8
         
         return image_array
 
-    def crop_sprite_tight(self, image_array):
+    def crop_sprite_tight(self, image_array, already_matted=False):
         """
         Crop a sprite tightly based on its alpha channel to create a "die-cut sticker" effect.
         First removes white background if present, then crops.
         
         Args:
             image_array: RGBA numpy array
+            already_matted: Skip background removal (image_array is already matted)
         
         Returns:
             Cropped RGBA image array
         """
         # First remove white background if present
-        image_array = self.remove_white_background(image_array)
+        if not already_matted:
+            image_array = self.remove_white_background(image_array)
         
         if image_array.shape[2] == 4:
             alpha = image_array[:, :, 3]
@@ -261,19 +255,23 @@ class StoryPoseGenerator:
         
         return image_array
 
-    def find_sprites_in_sheet(self, image_array, min_area=500):
+    def find_sprites_in_sheet(self, image_array, min_area=500, already_matted=False):
         """
         Find individual sprites in a sprite sheet by detecting connected components.
         
         Args:
             image_array: RGBA numpy array
             min_area: Minimum area for a valid sprite
+            already_matted: Skip background removal (image_array is already matted)
         
         Returns:
             List of bounding boxes (x, y, width, height) for each sprite
         """
         # First remove white background if present
-        processed_array = self.remove_white_background(image_array.copy())
+        if already_matted:
+            processed_array = image_array
+        else:
+            processed_array = self.remove_white_background(image_array.copy())
         
         # Create binary mask from alpha channel
         if processed_array.shape[2] == 4:
@@ -300,122 +298,297 @@ class StoryPoseGenerator:
         
         return sprites
 
-    def process_sprite_sheet(self, image_path: Path) -> list:
+    @timed("pose_generator", "decode")
+    def load_image_array(self, image_source):
+        """
+        Decode an image into an RGBA numpy array.
+        
+        Args:
+            image_source: Path to an image file, or the encoded image bytes
+        
+        Returns:
+            RGBA numpy array
+        """
+        if isinstance(image_source, (bytes, bytearray)):
+            image_source = io.BytesIO(image_source)
+        with Image.open(image_source) as image:
+            return np.array(image.convert("RGBA"))
+
+    def process_sprite_sheet(self, image_source) -> list:
         """
         Process a sprite sheet: detect, split, and crop individual sprites.
         
         Args:
-            image_path: Path to the sprite sheet image
+            image_source: Path to the sprite sheet image, or its encoded bytes
         
         Returns:
             List of cropped sprite images
         """
         # Load image
-        image = Image.open(image_path).convert("RGBA")
-        image_array = np.array(image)
+        image_array = self.load_image_array(image_source)
         
-        # Find sprites in the sheet (background removal happens inside)
-        sprites = self.find_sprites_in_sheet(image_array)
+        # Matte the whole sheet once; detection and cropping both reuse it
+        matted_array = self.remove_white_background(image_array)
         
-        cropped_sprites = []
-        for bbox in sprites:
-            # Extract sprite region
-            x, y, w, h = bbox
-            sprite_region = image_array[y:y+h, x:x+w].copy()
+        with span("pose_generator", "split_crop"):
+            sprites = self.find_sprites_in_sheet(matted_array, already_matted=True)
             
-            # Crop tight to remove excess alpha (includes background removal)
-            cropped = self.crop_sprite_tight(sprite_region)
-            cropped_sprites.append(Image.fromarray(cropped))
+            cropped_sprites = []
+            for bbox in sprites:
+                # Extract sprite region
+                x, y, w, h = bbox
+                sprite_region = matted_array[y:y+h, x:x+w]
+                
+                # Crop tight to remove excess alpha
+                cropped = self.crop_sprite_tight(sprite_region, already_matted=True)
+                cropped_sprites.append(Image.fromarray(cropped))
         
         return cropped_sprites
 
-    def process_single_sprite(self, image_path: Path) -> Image.Image:
+    def process_single_sprite(self, image_source) -> Image.Image:
         """
         Process a single sprite image: remove white background and crop excess alpha.
         
         Args:
-            image_path: Path to the sprite image
+            image_source: Path to the sprite image, or its encoded bytes
         
         Returns:
             Cropped sprite image
         """
         # Load image
-        image = Image.open(image_path).convert("RGBA")
-        image_array = np.array(image)
+        image_array = self.load_image_array(image_source)
         
         # Remove white background and crop tight
-        cropped = self.crop_sprite_tight(image_array)
+        matted_array = self.remove_white_background(image_array)
+        with span("pose_generator", "split_crop"):
+            cropped = self.crop_sprite_tight(matted_array, already_matted=True)
         
         return Image.fromarray(cropped)
 
-    def generate_and_process_pose(self, child_photo_path: str, task_name: str, task_config: dict, pose_number: int) -> list:
+
+def process_sprite_image(image_source, is_sheet: bool, edge_dtype=np.float32) -> list:
+    """
+    Process-pool entry point: turn one downloaded image into cropped sprites.
+    
+    Args:
+        image_source: Encoded image bytes, or a path to the image
+        is_sheet: Whether the image is a sprite sheet to split
+        edge_dtype: Working precision for edge decontamination
+    
+    Returns:
+        List of cropped sprite images
+    """
+    processor = SpriteProcessor(edge_dtype=edge_dtype)
+    if is_sheet:
+        return processor.process_sprite_sheet(image_source)
+    return [processor.process_single_sprite(image_source)]
+
+
+class StoryPoseGenerator(SpriteProcessor):
+    """
+    Generates and processes avatar poses for story composition.
+    """
+    def __init__(self, config_path: str = "story_pose_prompts.json", max_in_flight: int = None,
+                 requests_per_second: float = None, process_workers: int = None,
+                 process_queue_size: int = None, process_pool: ProcessPoolExecutor = None,
+                 keep_raw_images: bool = None):
         """
-        Generate a pose and process it into clean sprites.
+        Initializes the generator and loads configuration.
+        
+        Args:
+            config_path (str): Path to the JSON file containing prompts and parameters.
+            max_in_flight (int): Maximum number of OpenAI tasks running at once
+                (defaults to POSE_MAX_IN_FLIGHT or 4; 1 runs tasks sequentially).
+            requests_per_second (float): Sustained OpenAI request rate
+                (defaults to OPENAI_REQUESTS_PER_SECOND or 1.0).
+            process_workers (int): Size of the process pool for sprite processing
+                (defaults to SPRITE_PROCESS_WORKERS or the CPU count; 0 processes inline).
+            process_queue_size (int): Maximum number of downloaded images waiting on or
+                in the process pool (defaults to SPRITE_QUEUE_SIZE or twice the pool size).
+            process_pool (ProcessPoolExecutor): Optional pool shared with other generators,
+                e.g. across children; it is left running after `run`.
+            keep_raw_images (bool): Also write each raw OpenAI result to `raw/` for
+                debugging (defaults to KEEP_RAW_IMAGES=1).
+        """
+        load_dotenv()
+        
+        # Initialize OpenAI client
+        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        
+        if not os.getenv("OPENAI_API_KEY"):
+            sys.exit("❌ Error: OPENAI_API_KEY not found in .env file.")
+        
+        self.config = self._load_config(config_path)
+        
+        # Create output directory for processed sprites
+        self.output_dir = Path("assets/story_sprites") / datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Track generated poses for summary
+        self.generated_poses = []
+
+        # Concurrency limits for OpenAI calls
+        self.max_in_flight = max_in_flight or int(os.getenv("POSE_MAX_IN_FLIGHT", "4"))
+        rate = requests_per_second or float(os.getenv("OPENAI_REQUESTS_PER_SECOND", "1.0"))
+        self.rate_limiter = TokenBucket(rate=rate, capacity=self.max_in_flight)
+
+        # Optional half-precision edge processing when many sheets run in parallel
+        if os.getenv("SPRITE_HALF_PRECISION") == "1":
+            self.edge_dtype = np.float16
+
+        # Process pool for CPU-heavy sprite work, fed through a bounded queue
+        if process_workers is None:
+            process_workers = int(os.getenv("SPRITE_PROCESS_WORKERS", str(os.cpu_count() or 1)))
+        self.process_workers = process_workers
+        self.process_queue_size = process_queue_size or int(
+            os.getenv("SPRITE_QUEUE_SIZE", str(max(1, 2 * process_workers)))
+        )
+        self.process_slots = threading.BoundedSemaphore(self.process_queue_size)
+        self.process_pool = process_pool
+
+        # Raw OpenAI results are processed from memory and only kept for debugging
+        if keep_raw_images is None:
+            keep_raw_images = os.getenv("KEEP_RAW_IMAGES") == "1"
+        self.keep_raw_images = keep_raw_images
+
+    def _load_config(self, config_path: str) -> dict:
+        """Loads configuration from the specified JSON file."""
+        config_path_obj = Path(config_path)
+        if not config_path_obj.exists():
+            sys.exit(f"❌ Error: Config file not found at '{config_path}'.")
+        try:
+            with open(config_path_obj, 'r', encoding='utf-8') as f:
+                print(f"✅ Successfully loaded config from {config_path_obj.name}")
+                return json.load(f)
+        except json.JSONDecodeError:
+            sys.exit(f"❌ Error: Could not decode JSON from '{config_path}'.")
+
+    def _read_openai_image(self, response) -> bytes:
+        """Helper to get the encoded image bytes from an OpenAI API response."""
+        try:
+            if response.data[0].b64_json:
+                return base64.b64decode(response.data[0].b64_json)
+            elif response.data[0].url:
+                return requests.get(response.data[0].url, timeout=30).content
+            else:
+                raise Exception("No valid image data in OpenAI response")
+        except Exception as e:
+            raise Exception(f"Failed to read OpenAI image: {e}")
+
+    def generate_sprites(self, child_photo_path: str, task_name: str, task_config: dict) -> list:
+        """
+        Generate a pose with OpenAI and process it into clean sprites, without saving them.
+        Safe to call from several threads at once.
         
         Args:
             child_photo_path: Path to the reference photo
             task_name: Name of the task (e.g., "split1")
             task_config: Configuration containing prompt and params
-            pose_number: Starting pose number for naming
         
         Returns:
-            List of paths to generated sprite files
+            List of cropped sprite images, empty if the task failed
         """
         start_time = time.time()
-        temp_path = self.output_dir / f"temp_{task_name}.png"
-        generated_sprites = []
         
         try:
             # Generate image using OpenAI API
-            with open(child_photo_path, "rb") as image_file:
-                response = self.openai_client.images.edit(
-                    model="gpt-image-1",
-                    image=image_file,
-                    prompt=task_config['prompt'],
-                    **task_config['params']
-                )
-            
-            # Save temporary image
-            self._save_openai_image(response, temp_path)
+            self.rate_limiter.acquire()
+            with span("pose_generator", "openai_call"):
+                with open(child_photo_path, "rb") as image_file:
+                    response = self.openai_client.images.edit(
+                        model="gpt-image-1",
+                        image=image_file,
+                        prompt=task_config['prompt'],
+                        **task_config['params']
+                    )
+                
+                # Keep the result in memory; only persist the raw original when debugging
+                image_bytes = self._read_openai_image(response)
+            if self.keep_raw_images:
+                raw_dir = self.output_dir / "raw"
+                raw_dir.mkdir(exist_ok=True)
+                (raw_dir / f"{task_name}.png").write_bytes(image_bytes)
             
             # Check if it's a sprite sheet or single image
             size = task_config['params'].get('size', '1024x1024')
+            is_sheet = size == "1536x1024"
             
-            if size == "1536x1024":
-                # Process sprite sheet
-                print(f"   📋 Processing sprite sheet ({size})")
-                sprites = self.process_sprite_sheet(temp_path)
-                
-                for i, sprite in enumerate(sprites):
-                    sprite_path = self.output_dir / f"pose_{pose_number + i}.png"
-                    sprite.save(sprite_path, "PNG")
-                    generated_sprites.append(str(sprite_path))
-                    print(f"   ✂️ Saved cropped sprite: pose_{pose_number + i}.png (size: {sprite.size})")
-                
+            if is_sheet:
+                print(f"   📋 Processing sprite sheet for '{task_name}' ({size})")
             else:  # 1024x1024 or other single images
-                # Process single sprite
-                print(f"   🖼️ Processing single sprite ({size})")
-                sprite = self.process_single_sprite(temp_path)
-                
-                sprite_path = self.output_dir / f"pose_{pose_number}.png"
-                sprite.save(sprite_path, "PNG")
-                generated_sprites.append(str(sprite_path))
-                print(f"   ✂️ Saved cropped sprite: pose_{pose_number}.png (size: {sprite.size})")
-            
-            # Clean up temporary file
-            temp_path.unlink()
+                print(f"   🖼️ Processing single sprite for '{task_name}' ({size})")
+            sprites = self.process_downloaded_image(image_bytes, is_sheet)
             
             generation_time = time.time() - start_time
-            print(f"   ⏱️ Processing time: {generation_time:.1f}s")
+            print(f"   ⏱️ '{task_name}' processing time: {generation_time:.1f}s")
             
-            return generated_sprites
+            return sprites
             
         except Exception as e:
             print(f"❌ Failed to generate/process {task_name}: {e}")
-            if temp_path.exists():
-                temp_path.unlink()
             return []
 
+    def process_downloaded_image(self, image_bytes: bytes, is_sheet: bool) -> list:
+        """
+        Hand a downloaded image to the process pool and wait for its sprites.
+        
+        Waits for a free queue slot first, so network threads back off when
+        the pool falls behind instead of piling up decoded images.
+        
+        Args:
+            image_bytes: Encoded image bytes as downloaded
+            is_sheet: Whether the image is a sprite sheet to split
+        
+        Returns:
+            List of cropped sprite images
+        """
+        if self.process_pool is None:
+            return process_sprite_image(image_bytes, is_sheet, self.edge_dtype)
+        
+        self.process_slots.acquire()
+        try:
+            future = self.process_pool.submit(process_sprite_image, image_bytes, is_sheet, self.edge_dtype)
+        except Exception:
+            self.process_slots.release()
+            raise
+        future.add_done_callback(lambda _: self.process_slots.release())
+        return future.result()
+
+    def save_sprites(self, sprites: list, pose_number: int) -> list:
+        """
+        Save processed sprites as consecutively numbered poses.
+        
+        Args:
+            sprites: List of sprite images
+            pose_number: Starting pose number for naming
+        
+        Returns:
+            List of paths to saved sprite files
+        """
+        saved_paths = []
+        for i, sprite in enumerate(sprites):
+            sprite_path = self.output_dir / f"pose_{pose_number + i}.png"
+            sprite.save(sprite_path, "PNG")
+            saved_paths.append(str(sprite_path))
+            print(f"   ✂️ Saved cropped sprite: pose_{pose_number + i}.png (size: {sprite.size})")
+        return saved_paths
+
+    def generate_and_process_pose(self, child_photo_path: str, task_name: str, task_config: dict, pose_number: int) -> list:
+        """
+        Generate a pose and process it into clean sprites.
+        
+        Args:
+            child_photo_path: Path to the reference photo
+            task_name: Name of the task (e.g., "split1")
+            task_config: Configuration containing prompt and params
+            pose_number: Starting pose number for naming
+        
+        Returns:
+            List of paths to generated sprite files
+        """
+        sprites = self.generate_sprites(child_photo_path, task_name, task_config)
+        return self.save_sprites(sprites, pose_number)
+
     def generate_image_dimensions_json(self):
         """
         Generate a JSON file containing dimensions of all generated sprites.
@@ -475,31 +648,41 @@ class StoryPoseGenerator:
             sys.exit("❌ Error: 'gpt' configuration not found in config file.")
         
         pose_counter = 1
-        total_time = 0
-        
-        # Process each task
-        for i, (task_name, task_config) in enumerate(tasks.items()):
-            print(f"🎨 Task {i+1}/{len(tasks)}: Generating '{task_name}'...")
-            
-            start_time = time.time()
-            sprites = self.generate_and_process_pose(
-                child_photo_path,
-                task_name,
-                task_config,
-                pose_counter
+        start_time = time.time()
+
+        # Network calls run on a thread pool while sprite processing runs on a
+        # process pool, so API waits and CPU work overlap across tasks
+        owns_pool = self.process_pool is None and self.process_workers > 0
+        if owns_pool:
+            # Workers start lazily inside a pose-task thread while other threads
+            # are mid-request; forking a multi-threaded process can deadlock them
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=self.process_workers, mp_context=multiprocessing.get_context("spawn")
             )
-            
-            if sprites:
-                self.generated_poses.extend(sprites)
-                # Update pose counter based on number of sprites generated
-                pose_counter += len(sprites)
-            
-            task_time = time.time() - start_time
-            total_time += task_time
-            
-            # Small delay between API calls
-            if i < len(tasks) - 1:
-                time.sleep(1)
+
+        # Run tasks concurrently, but number and save their sprites in task
+        # order so pose numbering doesn't depend on which call finishes first
+        print(f"⚡ Running {len(tasks)} tasks with up to {self.max_in_flight} in flight")
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="pose-task") as executor:
+                futures = [
+                    executor.submit(self.generate_sprites, child_photo_path, task_name, task_config)
+                    for task_name, task_config in tasks.items()
+                ]
+
+                for i, (task_name, future) in enumerate(zip(tasks, futures)):
+                    print(f"🎨 Task {i+1}/{len(tasks)}: Collecting '{task_name}'...")
+                    sprites = self.save_sprites(future.result(), pose_counter)
+                    if sprites:
+                        self.generated_poses.extend(sprites)
+                        # Update pose counter based on number of sprites generated
+                        pose_counter += len(sprites)
+        finally:
+            if owns_pool:
+                self.process_pool.shutdown()
+                self.process_pool = None
+
+        total_time = time.time() - start_time
         
         # Generate image dimensions JSON
         dimensions = self.generate_image_dimensions_json()
@@ -0,0 +1,127 @@
+# tests/test_remove_white_background.py
+"""
+The vectorized expansion-zone gradient in remove_white_background must match
+the original per-pixel loop exactly. The reference below is the original
+method with only the shared decontamination step delegated to the processor.
+"""
+
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from story_pose_generator import SpriteProcessor
+
+
+def reference_remove_white_background(processor, image_array):
+    h, w = image_array.shape[:2]
+    if image_array.shape[2] == 4 and np.mean(image_array[:, :, 3]) < 240:
+        return image_array
+
+    rgb = image_array[:, :, :3].copy()
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    core_white_mask = (gray >= 245).astype(np.uint8) * 255
+
+    flood_mask = np.zeros((h + 2, w + 2), np.uint8)
+    flood_image = core_white_mask.copy()
+    for corner in [(0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1)]:
+        if core_white_mask[corner[1], corner[0]] > 240:
+            cv2.floodFill(flood_image, flood_mask, corner, 128)
+    definite_background = (flood_image == 128).astype(np.uint8)
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    expanded_background = cv2.dilate(definite_background, kernel, iterations=2)
+
+    alpha_channel = np.ones((h, w), dtype=np.float32)
+    alpha_channel[definite_background == 1] = 0
+    expansion_zone = (expanded_background == 1) & (definite_background == 0)
+
+    if np.any(expansion_zone):
+        zone_coords = np.where(expansion_zone)
+        for y, x in zip(zone_coords[0], zone_coords[1]):
+            pixel_gray = gray[y, x]
+            if pixel_gray > 230:
+                alpha_val = max(0, 255 - ((pixel_gray - 230) / 25 * 255))
+                alpha_channel[y, x] = alpha_val / 255.0
+            elif pixel_gray > 200:
+                alpha_val = min(255, (230 - pixel_gray) / 30 * 128 + 127)
+                alpha_channel[y, x] = alpha_val / 255.0
+
+    alpha_channel = cv2.GaussianBlur(alpha_channel, (3, 3), 0.8)
+    rgb_decontaminated = processor.decontaminate_edges(rgb.astype(np.float32), alpha_channel)
+
+    alpha_uint8 = (alpha_channel * 255).astype(np.uint8)
+    alpha_uint8 = cv2.morphologyEx(alpha_uint8, cv2.MORPH_CLOSE, np.ones((2, 2), np.uint8))
+    alpha_uint8 = cv2.GaussianBlur(alpha_uint8, (3, 3), 0.5)
+
+    if image_array.shape[2] == 3:
+        return np.dstack([rgb_decontaminated.astype(np.uint8), alpha_uint8])
+    image_array[:, :, :3] = rgb_decontaminated.astype(np.uint8)
+    image_array[:, :, 3] = alpha_uint8
+    return image_array
+
+
+def sprite_sheet(seed, size=(96, 160)):
+    """White sheet with a few figures whose edges fade into the background."""
+    rng = np.random.default_rng(seed)
+    h, w = size
+    sheet = np.full((h, w, 4), 255, dtype=np.uint8)
+    for cx in (w // 4, w // 2, 3 * w // 4):
+        cy = int(rng.integers(h // 3, 2 * h // 3))
+        radius = int(rng.integers(10, 18))
+        color = rng.integers(0, 200, size=3)
+        cv2.circle(sheet, (cx, cy), radius, (*map(int, color), 255), -1)
+        # Anti-aliased ring of light pixels spanning the 200-255 gradient bands
+        for step, gray in enumerate(range(200, 256, 6)):
+            cv2.circle(sheet, (cx, cy), radius + 1 + step // 3, (gray, gray, gray, 255), 1)
+    noise = rng.integers(-3, 4, size=(h, w, 3))
+    sheet[:, :, :3] = np.clip(sheet[:, :, :3].astype(int) + noise, 0, 255).astype(np.uint8)
+    return sheet
+
+
+def assert_same_result(image_array):
+    processor = SpriteProcessor()
+    expected = reference_remove_white_background(processor, image_array.copy())
+    actual = processor.remove_white_background(image_array.copy())
+    assert actual.dtype == expected.dtype
+    assert np.array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_white_margins(seed):
+    assert_same_result(sprite_sheet(seed))
+
+
+def test_rgb_input():
+    assert_same_result(np.ascontiguousarray(sprite_sheet(7)[:, :, :3]))
+
+
+def test_partly_transparent_edges():
+    sheet = sprite_sheet(11)
+    # Soft alpha along the border, still opaque enough on average to be processed
+    sheet[:3, :, 3] = 128
+    sheet[:, -3:, 3] = 64
+    assert np.mean(sheet[:, :, 3]) >= 240
+    assert_same_result(sheet)
+
+
+def test_already_transparent_is_untouched():
+    sheet = sprite_sheet(13)
+    sheet[:, :, 3] = 0
+    assert_same_result(sheet)
+
+
+def test_empty_expansion_zone():
+    # No white corners: nothing is flood-filled, so the expansion zone is empty
+    sheet = np.full((48, 48, 4), 120, dtype=np.uint8)
+    sheet[:, :, 3] = 255
+    assert_same_result(sheet)
+
+
+def test_all_white_sheet():
+    # Everything is background, so the expansion zone is empty as well
+    assert_same_result(np.full((48, 48, 4), 255, dtype=np.uint8))